@@ -1,16 +1,30 @@
 import asyncio
+import os
+import tempfile
 import uuid
 
 import luxis.daemon as daemon
 
-from fastapi import Query, Body, Security, Depends, APIRouter
+from fastapi import Query, Body, Security, Depends, APIRouter, Request
 from fastapi.security import APIKeyHeader
+from pathlib import Path
 from pydantic import BaseModel, SecretStr, Field
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse, JSONResponse
 from typing import Tuple, List
 
-from luxis.core.schemas import AIProviders, QueryConfig, Directories
-from luxis.services import update, query
-from luxis.utils.daemon import _load_or_create_user_config, _replace_api_key_in_config
+from luxis.core.embedding import apply_embedding_model
+from luxis.core.schemas import AIProviders, QueryConfig, Directories, EmbeddingModel
+from luxis.services import update, query, snapshot
+from luxis.utils.daemon import (
+    _load_or_create_user_config,
+    _replace_api_key_in_config,
+    _user_snapshots,
+    _pin_index_paths,
+    _forward_to_writer,
+    _start_migration,
+    _migration_status,
+)
 from luxis.utils.logger import logger
 
 router = APIRouter()
@@ -53,6 +67,7 @@ async def get_api_key(
 
 @router.post("/ingest")
 async def ingest_endpoint(
+    request: Request,
     user_id: uuid.UUID = Query(...),
     invalidate_config: bool = Query(False),
     clean_index: bool = Query(False),
@@ -60,12 +75,15 @@ async def ingest_endpoint(
     body: IndexRequest = Body(...),
     api_key_info: Tuple[SecretStr, AIProviders] = Depends(get_api_key),
 ):
+    if daemon.WRITER_URL:
+        return await _forward_to_writer(request)
     cfg = await _load_or_create_user_config(daemon.BASE_CONFIG, user_id, invalidate_config)
     cfg = await _replace_api_key_in_config(cfg, api_key_info)
     cfg.directories = body.directories
 
     start = asyncio.get_event_loop().time()
-    response = await update.run_index_update(cfg, clean_index)
+    async with _user_snapshots(user_id).write(clean_index) as staging:
+        response = await update.run_index_update(_pin_index_paths(cfg, staging), clean_index)
     elapsed = asyncio.get_event_loop().time() - start
     if verbose:
         response["elapsed"] = elapsed
@@ -85,11 +103,94 @@ async def query_endpoint(
     cfg.query = body.query_config
 
     results_all = []
-    for text in body.texts:
-        results = []
-        entries = await query.run_query(text, cfg)
-        logger.info(f"Found {len(entries)} entries")
-        if entries:
-            results.extend(entries)
-        results_all.append(results)
+    async with _user_snapshots(user_id).read() as snapshot:
+        cfg = _pin_index_paths(cfg, snapshot)
+        for text in body.texts:
+            results = []
+            entries = await query.run_query(text, cfg)
+            logger.info(f"Found {len(entries)} entries")
+            if entries:
+                results.extend(entries)
+            results_all.append(results)
     return {"status": "success", "results": results_all}
+
+
+@router.get("/snapshot/export")
+async def snapshot_export_endpoint(
+    user_id: uuid.UUID = Query(...),
+    api_key_info: Tuple[SecretStr, AIProviders] = Depends(get_api_key),
+):
+    cfg = await _load_or_create_user_config(daemon.BASE_CONFIG, user_id, False)
+    cfg = await _replace_api_key_in_config(cfg, api_key_info)
+    fd, name = tempfile.mkstemp(suffix=".tar.gz")
+    os.close(fd)
+    archive = Path(name)
+    try:
+        async with _user_snapshots(user_id).read() as pinned:
+            await snapshot.export_snapshot(_pin_index_paths(cfg, pinned), archive)
+    except Exception:
+        archive.unlink(missing_ok=True)
+        raise
+    return FileResponse(
+        archive,
+        media_type="application/gzip",
+        filename=f"{user_id}.tar.gz",
+        background=BackgroundTask(archive.unlink, missing_ok=True),
+    )
+
+
+@router.post("/snapshot/import")
+async def snapshot_import_endpoint(
+    request: Request,
+    user_id: uuid.UUID = Query(...),
+    index_type: str | None = Query(None),
+    model_name: str | None = Query(None),
+    nprobe: int | None = Query(None),
+    api_key_info: Tuple[SecretStr, AIProviders] = Depends(get_api_key),
+):
+    if daemon.WRITER_URL:
+        return await _forward_to_writer(request)
+    cfg = await _load_or_create_user_config(daemon.BASE_CONFIG, user_id, False)
+    cfg = await _replace_api_key_in_config(cfg, api_key_info)
+    with tempfile.NamedTemporaryFile(suffix=".tar.gz") as archive:
+        async for chunk in request.stream():
+            archive.write(chunk)
+        archive.flush()
+        async with _user_snapshots(user_id).write(clean=True) as staging:
+            manifest = await snapshot.import_snapshot(
+                _pin_index_paths(cfg, staging), Path(archive.name), index_type, model_name, nprobe
+            )
+    return {"status": "success", "vectors": sum(shard["count"] for shard in manifest["shards"])}
+
+
+@router.post("/migrate", status_code=202)
+async def migrate_endpoint(
+    request: Request,
+    user_id: uuid.UUID = Query(...),
+    body: EmbeddingModel = Body(...),
+    api_key_info: Tuple[SecretStr, AIProviders] = Depends(get_api_key),
+):
+    if daemon.WRITER_URL:
+        return await _forward_to_writer(request)
+    cfg = await _load_or_create_user_config(daemon.BASE_CONFIG, user_id, False)
+    cfg = await _replace_api_key_in_config(cfg, api_key_info)
+    target = apply_embedding_model(cfg.model_copy(deep=True), body)
+    # Migrations of large indexes take hours at the paced embedding rate, so they run in the background.
+    migration = _start_migration(user_id, cfg, target)
+    if migration is None:
+        return JSONResponse(status_code=409, content={"status": "running", "migration": _migration_status(user_id)})
+    return {"status": "started", "migration": migration}
+
+
+@router.get("/migrate/status")
+async def migrate_status_endpoint(
+    request: Request,
+    user_id: uuid.UUID = Query(...),
+    api_key_info: Tuple[SecretStr, AIProviders] = Depends(get_api_key),
+):
+    if daemon.WRITER_URL:
+        return await _forward_to_writer(request)
+    migration = _migration_status(user_id)
+    if migration is None:
+        return JSONResponse(status_code=404, content={"detail": f"No model migration was started for user {user_id}."})
+    return {"status": "success", "migration": migration}
@@ -5,19 +5,20 @@ import signal
 import tomllib
 import click
 
+from pathlib import Path
+
 from luxis.core.schemas import (
     Config,
     Directories,
+    EmbeddingModel,
     IngestConfig,
     QueryConfig,
     GeneralSettings,
     AzureOpenAISettings,
     OpenAISettings,
 )
-from luxis.services import update, query
 from luxis.utils.logger import logger, setup_logging
 from luxis.utils.pid_handler import read_pid
-from luxis.daemon import run_daemon
 
 
 def load_config(path: str | None):
@@ -63,7 +64,9 @@ def cli():
 def daemon(config_path, action):
     if action == "start":
         config = load_config(config_path)
-        setup_logging(config.settings.log_level)
+        setup_logging(settings=config.settings)
+        from luxis.daemon import run_daemon
+
         run_daemon(config)
         sys.exit(0)
 
@@ -91,8 +94,10 @@ def daemon(config_path, action):
 )
 def index(config_path):
     config = load_config(config_path)
-    setup_logging(config.settings.log_level)
-    asyncio.run(update.run_index_update(config))
+    setup_logging(settings=config.settings)
+    from luxis.services import update
+
+    asyncio.run(update.run_index_update(config, False))
 
 
 @cli.command(help="Query the index with a text string.")
@@ -106,10 +111,75 @@ def index(config_path):
 @click.argument("query_text", type=str)
 def query_cmd(config_path, query_text):
     config = load_config(config_path)
-    setup_logging(config.settings.log_level)
+    setup_logging(settings=config.settings)
+    from luxis.services import query
+
     asyncio.run(query.run_query(query_text, config))
 
 
+@cli.group(help="Export or import index snapshots.")
+def snapshot():
+    pass
+
+
+@snapshot.command("export", help="Write the index into a checksummed snapshot archive.")
+@click.option(
+    "-c",
+    "--config",
+    "config_path",
+    type=click.Path(exists=False, dir_okay=False),
+    help="Path to configuration TOML file (luxis.toml)",
+)
+@click.argument("archive", type=click.Path(dir_okay=False))
+def snapshot_export(config_path, archive):
+    config = load_config(config_path)
+    setup_logging(settings=config.settings)
+    from luxis.services import snapshot as snapshot_service
+
+    asyncio.run(snapshot_service.export_snapshot(config, Path(archive)))
+
+
+@snapshot.command("import", help="Replace the index with the contents of a snapshot archive.")
+@click.option(
+    "-c",
+    "--config",
+    "config_path",
+    type=click.Path(exists=False, dir_okay=False),
+    help="Path to configuration TOML file (luxis.toml)",
+)
+@click.option("--index-type", default=None, help="FAISS factory string to rebuild the vectors into (e.g. IVF256,Flat)")
+@click.option("--nprobe", type=int, default=None, help="Lists searched per query by IVF index types (default: sqrt of lists)")
+@click.option("--model", "model_name", default=None, help="Refuse archives embedded with another model")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+def snapshot_import(config_path, index_type, nprobe, model_name, archive):
+    config = load_config(config_path)
+    setup_logging(settings=config.settings)
+    from luxis.services import snapshot as snapshot_service
+
+    asyncio.run(snapshot_service.import_snapshot(config, Path(archive), index_type, model_name, nprobe))
+
+
+@cli.command(help="Re-embed the index with another model, replacing it only once the new index is complete.")
+@click.option(
+    "-c",
+    "--config",
+    "config_path",
+    type=click.Path(exists=False, dir_okay=False),
+    help="Path to configuration TOML file (luxis.toml)",
+)
+@click.option("--model", "model_name", required=True, help="Embedding model to migrate to")
+@click.option("--dim", "embedding_dim", required=True, type=int, help="Embedding dimension of the new model")
+@click.option("--deployment", default=None, help="Azure OpenAI deployment of the new model")
+def migrate(config_path, model_name, embedding_dim, deployment):
+    config = load_config(config_path)
+    setup_logging(settings=config.settings)
+    from luxis.services import migrate as migrate_service
+
+    model = EmbeddingModel(model_name=model_name, embedding_dim=embedding_dim, deployment=deployment)
+    asyncio.run(migrate_service.run_model_migration(config, model))
+    logger.info("Update the model name and embedding_dim in your configuration to match the migrated index.")
+
+
 def main():
     cli()
 
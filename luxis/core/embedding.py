@@ -1,16 +1,20 @@
 import json
-import tiktoken
 
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
-from openai import AsyncOpenAI, AsyncAzureOpenAI
-from tika import parser
 
 from luxis.utils.logger import logger
-from luxis.core.schemas import AIProviders
+from luxis.core.schemas import AIProviders, EmbeddingModel
+from luxis.core.tokenizer import count_tokens
+
+TOKEN_LIMIT = 8192
+# Safety margin on token counts before checking them against TOKEN_LIMIT.
+TOKEN_ESTIMATE_FACTOR = 1.15
 
 
 async def _build_client(config):
+    from openai import AsyncOpenAI, AsyncAzureOpenAI
+
     if config.settings.ai_provider == AIProviders.AzureOpenAI:
         s = config.azure_settings
         logger.debug(s.azure_openai_api_key.get_secret_value())
@@ -30,39 +34,89 @@ async def _build_client(config):
         raise ValueError(f"Unsupported ai_provider: {config.settings.ai_provider}")
 
 
-async def extract_text(path: Path) -> str:
-    parsed = parser.from_file(str(path))
+def embedding_model_name(config) -> str:
+    if config.settings.ai_provider == AIProviders.AzureOpenAI:
+        return config.azure_settings.azure_openai_model_name
+    return config.openai_settings.openai_model_name
+
+
+def apply_embedding_model(config, model: EmbeddingModel):
+    """Point ``config`` at another embedding model and dimension."""
+    if config.settings.ai_provider == AIProviders.AzureOpenAI:
+        config.azure_settings.azure_openai_model_name = model.model_name
+        config.azure_settings.azure_openai_deployment = model.deployment or model.model_name
+    else:
+        config.openai_settings.openai_model_name = model.model_name
+    config.ingest.embedding_dim = model.embedding_dim
+    return config
+
+
+def current_embedding_model(config) -> EmbeddingModel:
+    azure = config.settings.ai_provider == AIProviders.AzureOpenAI
+    return EmbeddingModel(
+        model_name=embedding_model_name(config),
+        embedding_dim=config.ingest.embedding_dim,
+        deployment=config.azure_settings.azure_openai_deployment if azure else None,
+    )
+
+
+async def extract_text(path: Path, data: bytes | None = None) -> str:
+    """Extract the text of ``path``, or of ``data`` already read from it, so the file is not read again."""
+    from tika import parser
+    from tika.tika import make_content_disposition_header
+
+    if data is None:
+        parsed = parser.from_file(str(path))
+    else:
+        # from_file names the file for Tika, which uses the name to detect the type; buffers need it passed along.
+        parsed = parser.from_buffer(data, headers={"Content-Disposition": make_content_disposition_header(str(path))})
     return parsed.get("content", "") or ""
 
 
 async def get_texts_statistics(texts: List[str], model_name: str) -> Dict[str, Any]:
-    enc = tiktoken.encoding_for_model(model_name)
-    token_counts = [len(enc.encode(t)) for t in texts]
+    token_counts = await count_tokens(texts, model_name)
     lengths = [len(t) for t in texts]
     return {
         "subtexts": len(texts),
-        "total_tokens_est": int(sum(token_counts) * 1.15),
+        "total_tokens_est": int(sum(token_counts) * TOKEN_ESTIMATE_FACTOR),
         "total_chars": sum(lengths),
         "max_tokens": max(token_counts or [0]),
         "max_length": max(lengths or [0]),
     }
 
 
+def _with_meta(texts: List[str], meta_data: Dict[str, Any] | None) -> List[str]:
+    suffix = json.dumps(meta_data or {})
+    return [t + suffix for t in texts]
+
+
+async def token_batches(texts: List[str], config, meta_data: Dict[str, Any] | None = None) -> List[List[int]]:
+    """Group the indices of ``texts`` into consecutive batches that each fit into one embedding request.
+
+    A text that is too big on its own still gets a batch of its own, which ``embed_texts`` then rejects.
+    """
+    counts = await count_tokens(_with_meta(texts, meta_data), embedding_model_name(config))
+    batches, current, total = [], [], 0
+    for i, count in enumerate(counts):
+        if current and (total + count) * TOKEN_ESTIMATE_FACTOR > TOKEN_LIMIT:
+            batches.append(current)
+            current, total = [], 0
+        current.append(i)
+        total += count
+    if current:
+        batches.append(current)
+    return batches
+
+
 async def embed_texts(texts: List[str], config, meta_data: Dict[str, Any] | None = None) -> Tuple[bool, List[List[float]]]:
-    token_limit = 8192
-    meta_data = meta_data or {}
-    client = await _build_client(config)
-    model_name = (
-        config.azure_settings.azure_openai_model_name
-        if config.settings.ai_provider == AIProviders.AzureOpenAI
-        else config.openai_settings.openai_model_name
-    )
-    texts = [t + json.dumps(meta_data) for t in texts]
+    model_name = embedding_model_name(config)
+    texts = _with_meta(texts, meta_data)
     stats = await get_texts_statistics(texts, model_name)
     logger.debug("Embedding batch stats: {}", stats)
-    if stats["total_tokens_est"] > token_limit:
-        logger.info(f"Estimated tokens: {stats['total_tokens_est']} above limit of {token_limit}.")
+    if stats["total_tokens_est"] > TOKEN_LIMIT:
+        logger.info(f"Estimated tokens: {stats['total_tokens_est']} above limit of {TOKEN_LIMIT}.")
         return False, []
+    client = await _build_client(config)
     response = await client.embeddings.create(input=texts, model=model_name)
     embeddings = [d.embedding for d in response.data]
     logger.debug(f"Received {len(embeddings)} embeddings.")
@@ -1,11 +1,41 @@
 import hashlib
+import mmap
 
+from contextlib import asynccontextmanager
 from pathlib import Path
 
+from luxis.core.schemas import FilePolicy
+from luxis.utils.logger import logger
 
-async def sha256sum(path: Path) -> str:
-    h = hashlib.sha256()
+_BINARY_SNIFF_BYTES = 8192
+
+
+@asynccontextmanager
+async def read_file(path: Path, policy: FilePolicy | None = None):
+    """Read ``path`` once for both hashing and text extraction.
+
+    Yields ``(filehash, data)``, or ``None`` if ``policy`` skips the file. The policy is checked against the file
+    size and its first bytes before anything else is read. ``data`` is a read-only memory map of the file (or the
+    sampled bytes) and is only valid inside the block.
+    """
+    size = path.stat().st_size
+    if policy and policy.max_size_mb is not None and size > policy.max_size_mb * 1024 * 1024:
+        logger.info(f"Skipping {path}: {size / 1024 / 1024:.1f} MB is above the limit of {policy.max_size_mb} MB.")
+        yield None
+        return
     with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+        if policy and policy.skip_binary and b"\0" in f.read(_BINARY_SNIFF_BYTES):
+            logger.info(f"Skipping binary file {path}")
+            yield None
+            return
+        f.seek(0)
+        if policy and policy.sample_kb is not None and size > policy.sample_kb * 1024:
+            data = f.read(policy.sample_kb * 1024)
+            yield hashlib.sha256(data).hexdigest(), data
+            return
+        if not size:
+            yield hashlib.sha256(b"").hexdigest(), b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Hashing through the buffer protocol leaves the map positioned at the start for extraction.
+            yield hashlib.sha256(mapped).hexdigest(), mapped
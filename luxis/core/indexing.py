@@ -1,9 +1,14 @@
-import numpy as np
+import os
+import re
 
-from pathlib import Path
+from pathlib import Path, PurePath
 
-from luxis.index.vector_index import VectorIndex
+from luxis.core.embedding import apply_embedding_model, current_embedding_model, extract_text
+from luxis.core.hashing import read_file
+from luxis.core.schemas import EmbeddingModel, FilePolicy
+from luxis.index.vector_index import DEFAULT_SHARD, ShardedVectorIndex, VectorIndex
 from luxis.index.meta_index import MetaIndex
+from luxis.index.text_cache import TextCache
 from luxis.utils.logger import logger
 from luxis.utils.file_handler import ensure_dir_exists
 
@@ -13,40 +18,137 @@ class IndexManager:
         self.config = config
         self.vector_index_path = config.settings.vector_index_path
         self.meta_index_path = config.settings.meta_index_path
+        self.text_cache_path = config.settings.text_cache_path
+        self.model_path = Path(self.vector_index_path).with_suffix(".model.json")
 
-    async def setup(self, clean_index: bool = False):
+    async def setup(
+        self, clean_index: bool = False, load_vector: bool = True, read_only: bool = False, text_cache: bool = False
+    ):
         await ensure_dir_exists(Path(self.vector_index_path).parent, clean_index)
         await ensure_dir_exists(Path(self.meta_index_path).parent, clean_index)
+        self._apply_recorded_model()
         dim = self.config.ingest.embedding_dim
-        self.vector = VectorIndex(self.vector_index_path, dim=dim)
-        await self.vector.setup()
-        self.meta = MetaIndex(self.meta_index_path)
+        self.sharded = self.config.ingest.shard_by_directory or Path(self.vector_index_path).with_suffix(".shards").exists()
+        if self.sharded:
+            self.vector = ShardedVectorIndex(self.vector_index_path, dim=dim)
+        else:
+            self.vector = VectorIndex(self.vector_index_path, dim=dim)
+        if load_vector:
+            await self.vector.setup(read_only)
+        self.meta = await MetaIndex.open(self.meta_index_path, pool_size=self.config.settings.meta_pool_size)
         logger.info(f"Vector index initialized at {self.vector_index_path} (dim={dim})")
         logger.info(f"Meta index initialized at {self.meta_index_path}")
+        # Only paths that extract text need the cache; queries skip it.
+        self.text_cache = None
+        if text_cache:
+            max_bytes = self.config.ingest.text_cache_max_mb * 1024 * 1024
+            self.text_cache = await TextCache.open(self.text_cache_path, max_bytes=max_bytes)
+            logger.info(f"Text cache initialized at {self.text_cache_path} ({len(self.text_cache.entries)} entries)")
 
-    async def update(self, entries: list[tuple[list[float], str, str]]) -> None:
-        if not entries:
-            logger.debug("No entries to update.")
+    def _apply_recorded_model(self) -> None:
+        # Vectors are only comparable within one model, so the model that built the index wins over the config.
+        if not self.model_path.exists():
             return
-        for embedding, filepath, filehash in entries:
-            id_ = await self.meta.upsert(filepath=filepath, filehash=filehash)
-            await self.vector.upsert(id_, embedding)
-            logger.debug(f"Updated entry ID={id_} → {filepath}")
+        recorded = EmbeddingModel.model_validate_json(self.model_path.read_text())
+        if recorded != current_embedding_model(self.config):
+            logger.warning(
+                f"Index was built with {recorded.model_name} (dim={recorded.embedding_dim}); using it instead of the "
+                "configured model. Run a model migration to switch."
+            )
+            apply_embedding_model(self.config, recorded)
+
+    def record_model(self, model: EmbeddingModel | None = None) -> None:
+        tmp = self.model_path.with_suffix(".tmp")
+        tmp.write_text((model or current_embedding_model(self.config)).model_dump_json())
+        os.replace(tmp, self.model_path)
+
+    def shard_kwargs(self, filepath: str) -> dict:
+        if not self.sharded:
+            return {}
+        for directory_cfg in self.config.directories:
+            if PurePath(filepath).is_relative_to(directory_cfg.path):
+                return {"shard": re.sub(r"[^A-Za-z0-9_.-]+", "_", str(directory_cfg.path)).strip("_.") or DEFAULT_SHARD}
+        return {"shard": DEFAULT_SHARD}
+
+    def _policy(self, filepath: str) -> FilePolicy | None:
+        for directory_cfg in self.config.directories:
+            if PurePath(filepath).is_relative_to(directory_cfg.path):
+                return directory_cfg.policy_for(Path(filepath))
+        return None
+
+    async def content_text(self, filehash: str, filepath: str) -> str | None:
+        """Return the text of content ``filehash`` from the text cache, or extract it again from ``filepath``.
+
+        Returns ``None`` if the file is gone or no longer has that content.
+        """
+        text = await self.text_cache.get(filehash)
+        if text is None:
+            try:
+                async with read_file(Path(filepath), self._policy(filepath)) as content:
+                    if content is None or content[0] != filehash:
+                        logger.warning(f"Skipping {filepath}: it no longer matches the indexed content.")
+                        return None
+                    text = await extract_text(Path(filepath), content[1])
+            except Exception as e:
+                logger.warning(f"Skipping {filepath}: {e}")
+                return None
+            await self.text_cache.put(filehash, text)
+        return text
+
+    async def backfill_texts(self) -> int:
+        """Add stored contents missing from the lexical index, e.g. of indexes built before it existed."""
+        if await self.meta.compact_texts():
+            logger.info("Rebuilding the lexical index to drop replaced texts.")
+        added = 0
+        for content_id, (filehash, filepath) in (await self.meta.missing_texts()).items():
+            text = await self.content_text(filehash, filepath)
+            if text is not None:
+                await self.meta.upsert_text(content_id, text)
+                added += 1
+        if added:
+            logger.info(f"Added {added} texts to the lexical index.")
+        return added
+
+    async def update(self, entries: list[tuple[list[float], str, str, str]], links: list[tuple[str, str]] = ()) -> list[str]:
+        """Store new embeddings and point ``links`` (path, hash) at already stored content.
+
+        Returns the linked paths; links whose content has no vector are skipped.
+        """
+        if not entries and not links:
+            logger.debug("No entries to update.")
+            return []
+        orphaned = []
+        for embedding, filepath, filehash, text in entries:
+            id_, created, released = await self.meta.upsert(filepath=filepath, filehash=filehash)
+            orphaned.extend(released)
+            if created:
+                await self.vector.upsert(id_, embedding, **self.shard_kwargs(filepath))
+                await self.meta.upsert_text(id_, text)
+            logger.debug("Updated entry ID={} → {}", id_, filepath)
+        linked = []
+        for filepath, filehash in links:
+            id_, _, released = await self.meta.upsert(filepath=filepath, filehash=filehash, create=False)
+            orphaned.extend(released)
+            if id_ is not None:
+                linked.append(filepath)
+                logger.debug("Linked {} to stored content ID={}", filepath, id_)
+        if orphaned:
+            await self.vector.remove(orphaned)
         await self.vector.save()
-        logger.info(f"Index updated and saved ({len(entries)} entries).")
+        if not self.model_path.exists():
+            self.record_model()
+        logger.info(f"Index updated and saved ({len(entries)} entries, {len(linked)} duplicates linked).")
+        return linked
+
+    async def close(self) -> None:
+        await self.meta.close()
 
     async def prune_missing(self, selected_files):
-        session = self.meta.Session()
-        all_entries = session.query(self.meta.FileEntry).all()
-        removed_files = []
-        for entry in all_entries:
-            if entry.filepath not in selected_files:
-                logger.info(f"Removing missing file: {entry.filepath}")
-                session.delete(entry)
-                self.vector.index.remove_ids(np.array([entry.id], dtype=np.int64))
-                removed_files.append(entry.filepath)
-        session.commit()
-        session.close()
+        removed_files, orphaned = await self.meta.remove_missing(selected_files)
+        for filepath in removed_files:
+            logger.info(f"Removing missing file: {filepath}")
+        if orphaned:
+            await self.vector.remove(orphaned)
         if len(removed_files) > 0:
             await self.vector.save()
             logger.info(f"Pruned {len(removed_files)} missing file entries from index.")
@@ -1,3 +1,5 @@
+import fnmatch
+
 from enum import Enum
 from pathlib import Path
 from typing import List, Optional
@@ -9,6 +11,19 @@ class AIProviders(str, Enum):
     AzureOpenAI = "AzureOpenAI"
 
 
+class LogFormats(str, Enum):
+    auto = "auto"
+    color = "color"
+    plain = "plain"
+    json = "json"
+
+
+class QueryModes(str, Enum):
+    vector = "vector"
+    lexical = "lexical"
+    hybrid = "hybrid"
+
+
 class AzureOpenAISettings(BaseModel):
     azure_openai_api_key: SecretStr = Field(..., description="Azure OpenAI API key")
     azure_openai_api_version: str = Field(..., description="Azure OpenAI API version")
@@ -22,12 +37,37 @@ class OpenAISettings(BaseModel):
     openai_model_name: str = Field(..., description="OpenAI model name")
 
 
+class EmbeddingModel(BaseModel):
+    model_name: str = Field(..., description="Embedding model name")
+    embedding_dim: int = Field(..., description="Embedding vector dimension of the model")
+    deployment: Optional[str] = Field(default=None, description="Azure OpenAI deployment (defaults to the model name)")
+
+
 class IngestConfig(BaseModel):
     embedding_dim: int = Field(default=1536, description="Embedding vector dimension")
+    shard_by_directory: bool = Field(default=False, description="Store one vector index shard per directories entry")
+    text_cache_max_mb: int = Field(default=2048, description="Size bound of the extracted text cache (MB)")
+    migration_batch_size: int = Field(default=16, description="Texts per embedding request while migrating models")
+    migration_rate: int = Field(default=60, description="Embedding requests per minute while migrating models")
 
 
 class QueryConfig(BaseModel):
     top_k: int = Field(default=10, description="Number of nearest neighbors to return")
+    mode: QueryModes = Field(default=QueryModes.vector, description="Vector, lexical (FTS5) or hybrid search")
+    rrf_k: int = Field(default=60, description="Rank constant for reciprocal-rank fusion in hybrid mode")
+    path_glob: Optional[str] = Field(default=None, description="Only return files matching this glob")
+    directory: Optional[str] = Field(default=None, description="Only return files below this directory")
+    extensions: List[str] = Field(default_factory=list, description="Only return files with these extensions")
+
+    def filters(self) -> dict:
+        return {"path_glob": self.path_glob, "directory": self.directory, "extensions": self.extensions}
+
+
+class FilePolicy(BaseModel):
+    pattern: str = Field(..., description="Glob matched against file paths, like ignore patterns")
+    max_size_mb: Optional[float] = Field(default=None, description="Skip matching files larger than this (MB)")
+    sample_kb: Optional[int] = Field(default=None, description="Only hash and extract the first KB of matching files")
+    skip_binary: bool = Field(default=False, description="Skip matching files with NUL bytes in their first 8 KB")
 
 
 class Directories(BaseModel):
@@ -45,10 +85,17 @@ class Directories(BaseModel):
         ],
         description="Ignored patterns",
     )
+    policies: List[FilePolicy] = Field(
+        default_factory=list, description="Size and content policies per pattern, applied before reading; first match wins"
+    )
+
+    def policy_for(self, path: Path) -> FilePolicy | None:
+        return next((policy for policy in self.policies if fnmatch.fnmatch(str(path), policy.pattern)), None)
 
 
 class GeneralSettings(BaseModel):
     log_level: str = Field(default="INFO", description="Log level")
+    log_format: LogFormats = Field(default=LogFormats.auto, description="Log output format (auto colorizes only on a TTY)")
     vector_index_path: str = Field(
         default="/tmp/luxis/data/vector_index.faiss",
         description="Path to FAISS index file",
@@ -57,6 +104,11 @@ class GeneralSettings(BaseModel):
         default="/tmp/luxis/data/meta_index.db",
         description="Path to metadata index DB",
     )
+    meta_pool_size: int = Field(default=4, description="Maximum open SQLite connections per metadata index")
+    text_cache_path: str = Field(
+        default="/tmp/luxis/text_cache",
+        description="Directory of the extracted text cache, kept outside the index directory",
+    )
     ai_provider: AIProviders = Field(default=AIProviders.OpenAI, description="AI provider selection")
 
 
@@ -66,6 +118,8 @@ class DaemonConfig(BaseModel):
     reload: bool = Field(default=False, description="Auto‑reload for development")
     shutdown_timeout: int = Field(default=10, description="Graceful shutdown wait time (seconds)")
     base_data_dir: Path = Field(default=Path("/tmp/luxis/data"), description="Base data path")
+    workers: int = Field(default=1, description="Query worker processes; above 1, ingest runs in a separate writer process")
+    writer_port: int = Field(default=8766, description="Loopback port of the ingest writer process")
 
 
 class Config(BaseModel):
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+
+# Token counts of recently seen texts, keyed by model and a digest of the text.
+_COUNT_CACHE: OrderedDict[tuple[str, bytes], int] = OrderedDict()
+_COUNT_CACHE_SIZE = 100_000
+_COUNT_CACHE_LOCK = threading.Lock()
+
+_NUM_THREADS = min(8, os.cpu_count() or 1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model_name)
+
+
+def _key(model_name: str, text: str) -> tuple[str, bytes]:
+    return model_name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def _count_tokens(texts: list[str], model_name: str) -> list[int]:
+    keys = [_key(model_name, text) for text in texts]
+    with _COUNT_CACHE_LOCK:
+        counts = [_COUNT_CACHE.get(key) for key in keys]
+    missing = [i for i, count in enumerate(counts) if count is None]
+    if missing:
+        # Special tokens are counted as plain text; they never reach the model as control tokens anyway.
+        tokens = get_encoding(model_name).encode_ordinary_batch([texts[i] for i in missing], num_threads=_NUM_THREADS)
+        for i, encoded in zip(missing, tokens):
+            counts[i] = len(encoded)
+    with _COUNT_CACHE_LOCK:
+        for key, count in zip(keys, counts):
+            _COUNT_CACHE[key] = count
+            _COUNT_CACHE.move_to_end(key)
+        while len(_COUNT_CACHE) > _COUNT_CACHE_SIZE:
+            _COUNT_CACHE.popitem(last=False)
+    return counts
+
+
+async def count_tokens(texts: list[str], model_name: str) -> list[int]:
+    """Count the tokens of each text, reusing counts of texts seen before.
+
+    Uncached texts are encoded in one multi-threaded batch off the event loop.
+    """
+    if not texts:
+        return []
+    return await asyncio.to_thread(_count_tokens, list(texts), model_name)
@@ -1,4 +1,6 @@
 import asyncio
+import multiprocessing
+import os
 import uvicorn
 
 from pathlib import Path
@@ -8,12 +10,17 @@ from urllib.request import Request
 
 from luxis.core.schemas import Config
 from luxis.utils.exceptions import log_exception
-from luxis.utils.logger import logger
+from luxis.utils.logger import logger, setup_logging
 from luxis.utils.pid_handler import write_pid
 from luxis.api.endpoints import router as endpoint_router
 
 BASE_CONFIG: Config | None = None
 CONFIG_DIR: Path | None = None
+# Set in query workers of a multi-process daemon; /ingest is forwarded to the writer process at this URL.
+WRITER_URL: str | None = None
+
+CONFIG_ENV = "LUXIS_DAEMON_CONFIG"
+WRITER_URL_ENV = "LUXIS_WRITER_URL"
 
 app = FastAPI()
 app.include_router(endpoint_router)
@@ -28,17 +35,56 @@ async def unhandled_exception_handler(request: Request, exc: Exception):
     )
 
 
-def run_daemon(config: Config):
-    global BASE_CONFIG, CONFIG_DIR
+def _configure(config: Config, writer_url: str | None = None):
+    global BASE_CONFIG, CONFIG_DIR, WRITER_URL
     BASE_CONFIG = config
     CONFIG_DIR = Path(config.daemon.base_data_dir) / "configs"
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+    WRITER_URL = writer_url
+
+
+def _run_writer(config: Config):
+    setup_logging(settings=config.settings)
+    _configure(config)
+    logger.info(f"Luxis ingest writer running on 127.0.0.1:{config.daemon.writer_port}")
+    uvicorn.run(app, host="127.0.0.1", port=config.daemon.writer_port, timeout_keep_alive=config.daemon.shutdown_timeout)
+
+
+def run_daemon(config: Config):
+    _configure(config)
     asyncio.run(write_pid())
     logger.info(f"Luxis daemon running on {config.daemon.host}:{config.daemon.port}")
-    uvicorn.run(
-        app,
-        host=config.daemon.host,
-        port=config.daemon.port,
-        reload=config.daemon.reload,
-        timeout_keep_alive=config.daemon.shutdown_timeout,
-    )
+    if config.daemon.workers <= 1:
+        uvicorn.run(
+            app,
+            host=config.daemon.host,
+            port=config.daemon.port,
+            reload=config.daemon.reload,
+            timeout_keep_alive=config.daemon.shutdown_timeout,
+        )
+        return
+
+    # Query workers are separate interpreters started by uvicorn; they rebuild their state from the environment.
+    # API keys are masked in the dump, which is fine as the daemon takes them from the request header.
+    writer = multiprocessing.get_context("spawn").Process(target=_run_writer, args=(config,), daemon=True)
+    writer.start()
+    os.environ[CONFIG_ENV] = config.model_dump_json()
+    os.environ[WRITER_URL_ENV] = f"http://127.0.0.1:{config.daemon.writer_port}"
+    logger.info(f"Starting {config.daemon.workers} query workers")
+    try:
+        uvicorn.run(
+            "luxis.daemon:app",
+            host=config.daemon.host,
+            port=config.daemon.port,
+            workers=config.daemon.workers,
+            timeout_keep_alive=config.daemon.shutdown_timeout,
+        )
+    finally:
+        writer.terminate()
+        writer.join(config.daemon.shutdown_timeout)
+
+
+if os.environ.get(CONFIG_ENV) and BASE_CONFIG is None:
+    _config = Config.model_validate_json(os.environ[CONFIG_ENV])
+    setup_logging(settings=_config.settings)
+    _configure(_config, os.environ.get(WRITER_URL_ENV))
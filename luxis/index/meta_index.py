@@ -1,45 +1,381 @@
-from sqlalchemy import Column, Integer, String, create_engine
+import asyncio
+import functools
+import os
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePath
+from sqlalchemy import Column, Integer, String, bindparam, create_engine, event, text
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.exc import NoResultFound
 
 Base = declarative_base()
 
+# All metadata I/O runs here so the event loop never waits on SQLite.
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="luxis-meta")
+
+# Metadata indexes opened by this process, keyed by database path, so concurrent requests share one connection pool.
+# Up to _IDLE_LIMIT indexes without users are kept for reuse; older idle ones are disposed.
+_OPEN_INDEXES: OrderedDict[str, "MetaIndex"] = OrderedDict()
+_IDLE_LIMIT = 32
+
+# Replaced texts stay in the contentless text index until they outnumber the live ones and at least this many.
+_MIN_STALE_TEXTS = 1000
+
+
+class ContentEntry(Base):
+    """One stored vector per distinct file content; its id is the vector id."""
+
+    __tablename__ = "content_entries"
+    id = Column(Integer, primary_key=True)
+    filehash = Column(String, index=True)
+
 
 class FileEntry(Base):
     __tablename__ = "file_entries"
     id = Column(Integer, primary_key=True)
     filepath = Column(String, unique=True)
     filehash = Column(String)
+    content_id = Column(Integer, index=True)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
 
 class MetaIndex:
-    def __init__(self, db_path: str):
-        self.engine = create_engine(f"sqlite:///{db_path}")
-        Base.metadata.create_all(self.engine)
+    def __init__(self, db_path: str, pool_size: int = 4):
+        self.engine = create_engine(
+            f"sqlite:///{db_path}",
+            pool_size=pool_size,
+            max_overflow=0,
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
         self.Session = sessionmaker(bind=self.engine)
         self.FileEntry = FileEntry
+        self.ContentEntry = ContentEntry
+        self.db_path = str(db_path)
+        self.inode: int | None = None
+        self.users = 0
 
-    async def upsert(self, filepath: str, filehash: str) -> int:
+    @classmethod
+    async def open(cls, db_path: str, pool_size: int = 4) -> "MetaIndex":
+        """Return this process's index for ``db_path``, creating it and its schema on first use.
+
+        Every ``open`` must be paired with a ``close``.
+        """
+        index = _OPEN_INDEXES.get(str(db_path))
+        if index is None or not index._same_file():
+            # A database deleted or replaced since (e.g. a retried snapshot staging directory) gets a fresh pool.
+            index = cls(db_path, pool_size=pool_size)
+            await index.setup()
+            _OPEN_INDEXES[index.db_path] = index
+        _OPEN_INDEXES.move_to_end(index.db_path)
+        index.users += 1
+        return index
+
+    def _same_file(self) -> bool:
+        # Pooled connections keep the old inode allocated, so a recreated file cannot reuse its number meanwhile.
+        try:
+            return os.stat(self.db_path).st_ino == self.inode
+        except FileNotFoundError:
+            return False
+
+    async def setup(self):
+        await self._run(self._create_schema)
+        self.inode = os.stat(self.db_path).st_ino
+
+    def _create_schema(self) -> None:
+        Base.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(file_entries)"))}
+            if "content_id" not in columns:
+                # Indexes from before deduplication used file ids as vector ids; keep them as content ids.
+                conn.execute(text("ALTER TABLE file_entries ADD COLUMN content_id INTEGER"))
+                conn.execute(text("INSERT INTO content_entries (id, filehash) SELECT id, filehash FROM file_entries"))
+                conn.execute(text("UPDATE file_entries SET content_id = id"))
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_file_entries_content_id ON file_entries (content_id)"))
+            tables = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+            # An earlier lexical index stored every text a second time; texts are indexed again from the text cache.
+            conn.execute(text("DROP TABLE IF EXISTS file_texts"))
+            # The text cache holds the texts, so the text index is contentless and its rows cannot be deleted. Each
+            # indexed text gets a new document id; text_docs maps the live ones to their content and the rest is
+            # skipped until compact_texts() rebuilds the index.
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS text_index USING fts5(content, content='')"))
+            conn.execute(
+                text("CREATE TABLE IF NOT EXISTS text_docs (id INTEGER PRIMARY KEY AUTOINCREMENT, content_id INTEGER UNIQUE)")
+            )
+            # One row per content id listing every path sharing that content.
+            conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS path_index USING fts5(filepath)"))
+            if "path_index" not in tables:
+                conn.execute(
+                    text(
+                        "INSERT INTO path_index (rowid, filepath) SELECT content_id, group_concat(filepath, ' ') "
+                        "FROM file_entries GROUP BY content_id"
+                    )
+                )
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(_DB_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+    async def close(self) -> None:
+        """Release this user's reference; the pool is disposed once it is idle and no longer kept for reuse."""
+        self.users = max(0, self.users - 1)
+        if self.users:
+            return
+        if _OPEN_INDEXES.get(self.db_path) is not self:
+            await self._run(self.engine.dispose)
+            return
+        idle = [index for index in _OPEN_INDEXES.values() if not index.users]
+        # Databases of collected snapshots stay open through their pool until disposed, so drop those first.
+        evicted = [index for index in idle if not index._same_file()]
+        live = [index for index in idle if index not in evicted]
+        evicted += live[: max(0, len(live) - _IDLE_LIMIT)]
+        for index in evicted:
+            del _OPEN_INDEXES[index.db_path]
+            await self._run(index.engine.dispose)
+
+    async def upsert(self, filepath: str, filehash: str, create: bool = True) -> tuple[int | None, bool, list[int]]:
+        """Point ``filepath`` at the content record for ``filehash``.
+
+        Returns the content id (``None`` if it does not exist and ``create`` is false), whether the content record
+        was created, and the content ids that lost their last path and whose vectors must be removed.
+        """
+        return await self._run(self._upsert, filepath, filehash, create)
+
+    def _upsert(self, filepath: str, filehash: str, create: bool) -> tuple[int | None, bool, list[int]]:
         session = self.Session()
         try:
-            entry = session.query(FileEntry).filter_by(filepath=filepath).one()
-            entry.filehash = filehash
-        except NoResultFound:
-            entry = FileEntry(filepath=filepath, filehash=filehash)
-            session.add(entry)
-        session.commit()
-        id_ = entry.id
-        session.close()
-        return id_
+            content = session.query(ContentEntry).filter_by(filehash=filehash).first()
+            created = content is None
+            if created:
+                if not create:
+                    return None, False, []
+                content = ContentEntry(filehash=filehash)
+                session.add(content)
+                session.flush()
+            previous = None
+            try:
+                entry = session.query(FileEntry).filter_by(filepath=filepath).one()
+                if entry.content_id != content.id:
+                    previous = entry.content_id
+                entry.filehash = filehash
+                entry.content_id = content.id
+            except NoResultFound:
+                entry = FileEntry(filepath=filepath, filehash=filehash, content_id=content.id)
+                session.add(entry)
+            session.flush()
+            affected = {content.id} | ({previous} if previous is not None else set())
+            orphaned = self._release(session, affected)
+            self._refresh_paths(session, affected - set(orphaned))
+            session.commit()
+            return content.id, created, orphaned
+        finally:
+            session.close()
+
+    @staticmethod
+    def _release(session, content_ids) -> list[int]:
+        orphaned = []
+        for content_id in content_ids:
+            if session.query(FileEntry).filter_by(content_id=content_id).first() is None:
+                session.query(ContentEntry).filter_by(id=content_id).delete()
+                session.execute(text("DELETE FROM text_docs WHERE content_id = :id"), {"id": content_id})
+                session.execute(text("DELETE FROM path_index WHERE rowid = :id"), {"id": content_id})
+                orphaned.append(content_id)
+        return orphaned
+
+    @staticmethod
+    def _refresh_paths(session, content_ids) -> None:
+        for content_id in content_ids:
+            session.execute(text("DELETE FROM path_index WHERE rowid = :id"), {"id": content_id})
+            session.execute(
+                text(
+                    "INSERT INTO path_index (rowid, filepath) "
+                    "SELECT :id, group_concat(filepath, ' ') FROM file_entries WHERE content_id = :id"
+                ),
+                {"id": content_id},
+            )
 
     async def get(self, id_: int) -> FileEntry | None:
+        return await self._run(self._get, id_)
+
+    def _get(self, id_: int) -> FileEntry | None:
         session = self.Session()
         obj = session.get(FileEntry, id_)
         session.close()
         return obj
 
     async def get_by_filepath(self, filepath: str) -> FileEntry | None:
+        return await self._run(self._get_by_filepath, filepath)
+
+    def _get_by_filepath(self, filepath: str) -> FileEntry | None:
         session = self.Session()
         entry = session.query(FileEntry).filter_by(filepath=filepath).first()
         session.close()
         return entry
+
+    async def content_hashes(self) -> set[str]:
+        return await self._run(self._content_hashes)
+
+    def _content_hashes(self) -> set[str]:
+        with self.engine.connect() as conn:
+            return set(conn.execute(text("SELECT filehash FROM content_entries")).scalars())
+
+    async def filehashes(self) -> dict[str, str]:
+        return await self._run(self._filehashes)
+
+    def _filehashes(self) -> dict[str, str]:
+        with self.engine.connect() as conn:
+            return dict(conn.execute(text("SELECT filepath, filehash FROM file_entries")).all())
+
+    async def contents(self) -> dict[int, tuple[str, str]]:
+        """Map every content id to its hash and one of its paths."""
+        return await self._run(self._contents)
+
+    def _contents(self) -> dict[int, tuple[str, str]]:
+        statement = (
+            "SELECT c.id, c.filehash, min(f.filepath) FROM content_entries c "
+            "JOIN file_entries f ON f.content_id = c.id GROUP BY c.id"
+        )
+        with self.engine.connect() as conn:
+            return {int(id_): (filehash, filepath) for id_, filehash, filepath in conn.execute(text(statement))}
+
+    async def remove_missing(self, selected_files) -> tuple[list[str], list[int]]:
+        """Delete entries whose file is not in ``selected_files``.
+
+        Returns the removed paths and the content ids that lost their last path.
+        """
+        return await self._run(self._remove_missing, set(selected_files))
+
+    def _remove_missing(self, selected_files: set[str]) -> tuple[list[str], list[int]]:
+        session = self.Session()
+        removed, affected = [], set()
+        for entry in session.query(FileEntry).all():
+            if entry.filepath not in selected_files:
+                session.delete(entry)
+                removed.append(entry.filepath)
+                affected.add(entry.content_id)
+        session.flush()
+        orphaned = self._release(session, affected)
+        self._refresh_paths(session, affected - set(orphaned))
+        session.commit()
+        session.close()
+        return removed, orphaned
+
+    async def paths_for(self, content_ids: list[int], **filters) -> list[str]:
+        """Expand ranked content ids into the paths sharing each content, keeping the ranking."""
+        if not content_ids:
+            return []
+        statement = "SELECT content_id, filepath FROM file_entries WHERE content_id IN :ids"
+        params = {"ids": list(content_ids)}
+        sql = self._filter_sql(**filters)
+        if sql is not None:
+            statement += f" AND {sql[0]}"
+            params.update(sql[1])
+        rows = await self._run(self._paths_for, statement + " ORDER BY filepath", params)
+        rank = {content_id: i for i, content_id in enumerate(content_ids)}
+        return [filepath for content_id, filepath in sorted(rows, key=lambda row: rank[row[0]])]
+
+    def _paths_for(self, statement: str, params: dict) -> list[tuple[int, str]]:
+        with self.engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(text(statement).bindparams(bindparam("ids", expanding=True)), params)]
+
+    async def upsert_text(self, content_id: int, content: str) -> None:
+        await self._run(self._upsert_text, content_id, content)
+
+    def _upsert_text(self, content_id: int, content: str) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM text_docs WHERE content_id = :id"), {"id": content_id})
+            doc_id = conn.execute(text("INSERT INTO text_docs (content_id) VALUES (:id)"), {"id": content_id}).lastrowid
+            conn.execute(
+                text("INSERT INTO text_index (rowid, content) VALUES (:doc, :content)"), {"doc": doc_id, "content": content}
+            )
+
+    async def missing_texts(self) -> dict[int, tuple[str, str]]:
+        """Map every content id without an indexed text to its hash and one of its paths."""
+        return await self._run(self._missing_texts)
+
+    def _missing_texts(self) -> dict[int, tuple[str, str]]:
+        statement = (
+            "SELECT c.id, c.filehash, min(f.filepath) FROM content_entries c "
+            "JOIN file_entries f ON f.content_id = c.id "
+            "WHERE c.id NOT IN (SELECT content_id FROM text_docs) GROUP BY c.id"
+        )
+        with self.engine.connect() as conn:
+            return {int(id_): (filehash, filepath) for id_, filehash, filepath in conn.execute(text(statement))}
+
+    async def compact_texts(self) -> bool:
+        """Empty the text index once replaced texts outnumber live ones; ``missing_texts`` then lists every content."""
+        return await self._run(self._compact_texts)
+
+    def _compact_texts(self) -> bool:
+        with self.engine.begin() as conn:
+            indexed = conn.execute(text("SELECT count(*) FROM text_index")).scalar()
+            live = conn.execute(text("SELECT count(*) FROM text_docs")).scalar()
+            if indexed - live <= max(live, _MIN_STALE_TEXTS):
+                return False
+            conn.execute(text("INSERT INTO text_index (text_index) VALUES ('delete-all')"))
+            conn.execute(text("DELETE FROM text_docs"))
+            return True
+
+    @staticmethod
+    def _filter_sql(
+        path_glob: str | None = None, directory: str | None = None, extensions: list[str] | None = None
+    ) -> tuple[str, dict] | None:
+        clauses, params = [], {}
+        if directory and str(PurePath(directory)) != ".":
+            clauses.append("substr(filepath, 1, length(:directory)) = :directory")
+            params["directory"] = str(PurePath(directory)).rstrip("/") + "/"
+        if path_glob:
+            clauses.append("filepath GLOB :path_glob")
+            params["path_glob"] = path_glob
+        if extensions:
+            ext_clauses = []
+            for i, ext in enumerate(extensions):
+                ext = ext.lstrip(".").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                ext_clauses.append(f"filepath LIKE :ext{i} ESCAPE '\\'")
+                params[f"ext{i}"] = f"%.{ext}"
+            clauses.append("(" + " OR ".join(ext_clauses) + ")")
+        if not clauses:
+            return None
+        return " AND ".join(clauses), params
+
+    async def filter_ids(self, **filters) -> list[int] | None:
+        """Resolve path filters to content ids, or ``None`` when no filter is set."""
+        sql = self._filter_sql(**filters)
+        if sql is None:
+            return None
+        return await self._run(self._filter_ids, *sql)
+
+    def _filter_ids(self, where: str, params: dict) -> list[int]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"SELECT DISTINCT content_id FROM file_entries WHERE {where}"), params)
+            return [int(row[0]) for row in rows]
+
+    async def search_text(self, query: str, k: int, **filters) -> list[int]:
+        # Quote every term so identifiers, paths and error codes are matched literally.
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if not terms:
+            return []
+        # Contents matching in both their text and their paths add up both scores.
+        statement = (
+            "SELECT content_id FROM ("
+            "SELECT d.content_id AS content_id, bm25(text_index) AS score FROM text_index "
+            "JOIN text_docs d ON d.id = text_index.rowid WHERE text_index MATCH :query "
+            "UNION ALL SELECT rowid, bm25(path_index) FROM path_index WHERE path_index MATCH :query)"
+        )
+        params = {"query": " OR ".join(terms), "k": k}
+        sql = self._filter_sql(**filters)
+        if sql is not None:
+            where, filter_params = sql
+            statement += f" WHERE content_id IN (SELECT content_id FROM file_entries WHERE {where})"
+            params.update(filter_params)
+        return await self._run(self._search_text, statement + " GROUP BY content_id ORDER BY sum(score) LIMIT :k", params)
+
+    def _search_text(self, statement: str, params: dict) -> list[int]:
+        with self.engine.connect() as conn:
+            return [int(row[0]) for row in conn.execute(text(statement), params)]
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+
+from contextlib import asynccontextmanager, closing
+from pathlib import Path
+
+VECTOR_INDEX_FILE = "vector_index.faiss"
+META_INDEX_FILE = "meta_index.db"
+VECTOR_SHARDS_DIR = "vector_index.shards"
+VECTOR_MODEL_FILE = "vector_index.model.json"
+
+
+def copy_sqlite(src: Path, dst: Path) -> None:
+    # The backup API yields a consistent copy even while other connections hold the database open.
+    with closing(sqlite3.connect(src)) as source:
+        with closing(sqlite3.connect(dst)) as target:
+            source.backup(target)
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class SnapshotStore:
+    """Versioned copies of one user's index files.
+
+    Readers pin the published snapshot for the duration of a request. Writers are serialised, work on a private
+    staging copy and publish it by atomically replacing the ``CURRENT`` pointer. Unpinned old snapshots are removed,
+    except for the ``retain`` most recent ones, which readers in other processes may still be opening.
+    """
+
+    def __init__(self, user_dir: Path, retain: int = 0, collect: bool = True):
+        self.user_dir = Path(user_dir)
+        self.retain = retain
+        self.collect = collect
+        self.snapshot_dir = self.user_dir / "snapshots"
+        self.pointer = self.user_dir / "CURRENT"
+        self.write_lock = asyncio.Lock()
+        self.readers: dict[str, int] = {}
+
+    def current(self) -> str:
+        # An empty version refers to the unversioned files directly in the user directory.
+        return self.pointer.read_text().strip() if self.pointer.exists() else ""
+
+    def path(self, version: str) -> Path:
+        return self.snapshot_dir / version if version else self.user_dir
+
+    @asynccontextmanager
+    async def read(self):
+        version = self.current()
+        self.readers[version] = self.readers.get(version, 0) + 1
+        try:
+            yield self.path(version)
+        finally:
+            self.readers[version] -= 1
+            if not self.readers[version]:
+                del self.readers[version]
+                await self._collect()
+
+    @asynccontextmanager
+    async def write(self, clean: bool = False):
+        async with self.write_lock:
+            current = self.current()
+            version = f"{int(current or 0) + 1:06d}"
+            staging = self.snapshot_dir / f".staging-{version}"
+            await asyncio.to_thread(shutil.rmtree, staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            if not clean:
+                await asyncio.to_thread(self._copy, self.path(current), staging)
+            try:
+                yield staging
+            except BaseException:
+                await asyncio.to_thread(shutil.rmtree, staging, ignore_errors=True)
+                raise
+            staging.rename(self.snapshot_dir / version)
+            tmp = self.pointer.with_suffix(".tmp")
+            tmp.write_text(version)
+            os.replace(tmp, self.pointer)
+            await self._collect()
+
+    @staticmethod
+    def _copy(src: Path, dst: Path) -> None:
+        # Vector files are only ever replaced, never written in place, so staging can share them with the published
+        # snapshot and an ingest writes just the shards it touches.
+        if (src / VECTOR_INDEX_FILE).exists():
+            link_or_copy(src / VECTOR_INDEX_FILE, dst / VECTOR_INDEX_FILE)
+        if (src / VECTOR_SHARDS_DIR).exists():
+            # Leftover temporary files of an interrupted save must not become shared inodes that a later save truncates.
+            skip_tmp = shutil.ignore_patterns("*.tmp")
+            shutil.copytree(src / VECTOR_SHARDS_DIR, dst / VECTOR_SHARDS_DIR, copy_function=link_or_copy, ignore=skip_tmp)
+        if (src / VECTOR_MODEL_FILE).exists():
+            link_or_copy(src / VECTOR_MODEL_FILE, dst / VECTOR_MODEL_FILE)
+        if (src / META_INDEX_FILE).exists():
+            copy_sqlite(src / META_INDEX_FILE, dst / META_INDEX_FILE)
+
+    async def _collect(self) -> None:
+        # Snapshots can be gigabytes, so they are deleted off the event loop; the versions to delete are picked on it.
+        if not self.collect:
+            return
+        current = self.current()
+        if current and "" not in self.readers and self.retain < int(current):
+            for name in (VECTOR_INDEX_FILE, VECTOR_MODEL_FILE, META_INDEX_FILE):
+                (self.user_dir / name).unlink(missing_ok=True)
+            await asyncio.to_thread(shutil.rmtree, self.user_dir / VECTOR_SHARDS_DIR, ignore_errors=True)
+        if not self.snapshot_dir.exists():
+            return
+        versions = sorted(path.name for path in self.snapshot_dir.iterdir() if not path.name.startswith("."))
+        retained = set(versions[-(self.retain + 1) :])
+        unused = [version for version in versions if version not in retained | {current} and version not in self.readers]
+        for version in unused:
+            await asyncio.to_thread(shutil.rmtree, self.snapshot_dir / version, ignore_errors=True)
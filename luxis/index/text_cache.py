@@ -0,0 +1,79 @@
+import asyncio
+import os
+import zlib
+
+from collections import OrderedDict
+from pathlib import Path
+
+# Caches already scanned by this process, keyed by directory; the daemon reuses them across ingests.
+_OPEN_CACHES: dict[str, "TextCache"] = {}
+
+
+class TextCache:
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+
+    @classmethod
+    async def open(cls, path: str, max_bytes: int) -> "TextCache":
+        """Return this process's cache at ``path``, scanning the directory only on first use."""
+        cache = _OPEN_CACHES.get(str(path))
+        if cache is None:
+            cache = cls(path, max_bytes)
+            await cache.setup()
+            _OPEN_CACHES[str(path)] = cache
+        cache.max_bytes = max_bytes
+        return cache
+
+    async def setup(self):
+        await asyncio.to_thread(self._scan)
+
+    def _scan(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        files = []
+        for file in self.path.glob("*/*.z"):
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, file.stem, stat.st_size))
+        for _, filehash, size in sorted(files):
+            self.entries[filehash] = size
+            self.total_bytes += size
+
+    def _file(self, filehash: str) -> Path:
+        return self.path / filehash[:2] / f"{filehash}.z"
+
+    async def get(self, filehash: str) -> str | None:
+        if filehash not in self.entries:
+            return None
+        file = self._file(filehash)
+        try:
+            data = file.read_bytes()
+            os.utime(file)
+        except FileNotFoundError:
+            self.total_bytes -= self.entries.pop(filehash)
+            return None
+        self.entries.move_to_end(filehash)
+        return zlib.decompress(data).decode("utf-8")
+
+    async def put(self, filehash: str, text: str) -> None:
+        data = zlib.compress(text.encode("utf-8"), level=6)
+        if len(data) > self.max_bytes:
+            return
+        file = self._file(filehash)
+        file.parent.mkdir(exist_ok=True)
+        tmp = file.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, file)
+        self.total_bytes += len(data) - self.entries.pop(filehash, 0)
+        self.entries[filehash] = len(data)
+        await self._evict()
+
+    async def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self.entries:
+            filehash, size = self.entries.popitem(last=False)
+            self._file(filehash).unlink(missing_ok=True)
+            self.total_bytes -= size
@@ -1,9 +1,22 @@
+import asyncio
 import faiss
+import os
 
 import numpy as np
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Read-only indexes shared by all queries in this process, keyed by path and modification time.
+_READ_ONLY_CACHE: OrderedDict[tuple[str, int], faiss.Index] = OrderedDict()
+_READ_ONLY_CACHE_SIZE = 32
+
+# FAISS releases the GIL while searching, so shards are searched in parallel on this pool.
+_SEARCH_EXECUTOR = ThreadPoolExecutor(thread_name_prefix="luxis-search")
+
+DEFAULT_SHARD = "default"
+
 
 class VectorIndex:
     def __init__(self, path: str, dim: int):
@@ -11,9 +24,9 @@ class VectorIndex:
         self.dim = dim
         self.index = faiss.IndexIDMap(faiss.IndexFlatL2(dim))
 
-    async def setup(self):
+    async def setup(self, read_only: bool = False):
         if self.path.exists():
-            await self.load()
+            await self.load(read_only)
 
     async def upsert(self, id_: int, embedding: list[float]) -> None:
         vec = np.array([embedding], dtype=np.float32)
@@ -21,13 +34,126 @@ class VectorIndex:
         self.index.remove_ids(ids)
         self.index.add_with_ids(vec, ids)
 
-    async def query(self, embedding: list[float], k: int = 5):
+    async def remove(self, ids: list[int]) -> int:
+        return self.index.remove_ids(np.array(ids, dtype=np.int64))
+
+    def search(self, vec: np.ndarray, k: int, ids: list[int] | None = None) -> tuple[np.ndarray, np.ndarray]:
+        if ids is None:
+            return self.index.search(x=vec, k=k)
+        selector = faiss.IDSelectorBatch(np.array(ids, dtype=np.int64))
+        # IVF indexes only accept their own parameter type, which also carries the number of lists to probe.
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        return self.index.search(x=vec, k=k, params=params)
+
+    async def query(self, embedding: list[float], k: int = 5, ids: list[int] | None = None):
+        if ids is not None and not ids:
+            return []
         vec = np.array([embedding], dtype=np.float32)
-        distances, ids = self.index.search(x=vec, k=k)
+        distances, ids = self.search(vec, k, ids)
         return [int(i) for i in ids[0] if i != -1]
 
+    def relocate(self, path: str) -> None:
+        self.path = Path(path)
+
     async def save(self) -> None:
-        faiss.write_index(self.index, str(self.path))
+        # Replace rather than overwrite, so processes that memory-mapped the old file keep a valid mapping.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        faiss.write_index(self.index, str(tmp))
+        os.replace(tmp, self.path)
+
+    async def load(self, read_only: bool = False) -> None:
+        if not read_only:
+            self.index = faiss.read_index(str(self.path))
+            return
+        key = (str(self.path), self.path.stat().st_mtime_ns)
+        index = _READ_ONLY_CACHE.get(key)
+        if index is None:
+            index = faiss.read_index(str(self.path), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            _READ_ONLY_CACHE[key] = index
+            while len(_READ_ONLY_CACHE) > _READ_ONLY_CACHE_SIZE:
+                _READ_ONLY_CACHE.popitem(last=False)
+        _READ_ONLY_CACHE.move_to_end(key)
+        self.index = index
+
+
+class ShardedVectorIndex:
+    """Vector index split into independently stored shards under ``<path>.shards/<shard>.faiss``.
+
+    Only shards touched since loading are written on save; those left empty are deleted. Queries search all shards in
+    parallel and merge by distance.
+    An unsharded index found at ``path`` is adopted as the default shard.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = Path(path)
+        self.shard_dir = self.path.with_suffix(".shards")
+        self.dim = dim
+        self.shards: dict[str, VectorIndex] = {}
+        self.dirty: set[str] = set()
+        self.adopted_legacy = False
+
+    def _shard(self, name: str) -> VectorIndex:
+        if name not in self.shards:
+            self.shards[name] = VectorIndex(str(self.shard_dir / f"{name}.faiss"), self.dim)
+        return self.shards[name]
+
+    async def setup(self, read_only: bool = False):
+        if self.shard_dir.exists():
+            for file in sorted(self.shard_dir.glob("*.faiss")):
+                await self._shard(file.stem).setup(read_only)
+        if self.path.exists() and DEFAULT_SHARD not in self.shards:
+            legacy = VectorIndex(str(self.path), self.dim)
+            await legacy.load(read_only)
+            self._shard(DEFAULT_SHARD).index = legacy.index
+            self.dirty.add(DEFAULT_SHARD)
+            self.adopted_legacy = True
+
+    async def upsert(self, id_: int, embedding: list[float], shard: str = DEFAULT_SHARD) -> None:
+        await self._shard(shard).upsert(id_, embedding)
+        self.dirty.add(shard)
 
-    async def load(self) -> None:
-        self.index = faiss.read_index(str(self.path))
+    async def remove(self, ids: list[int], shard: str | None = None) -> int:
+        removed = 0
+        for name in [shard] if shard else list(self.shards):
+            if name in self.shards and (count := await self.shards[name].remove(ids)):
+                self.dirty.add(name)
+                removed += count
+        return removed
+
+    async def query(self, embedding: list[float], k: int = 5, ids: list[int] | None = None):
+        if (ids is not None and not ids) or not self.shards:
+            return []
+        vec = np.array([embedding], dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(_SEARCH_EXECUTOR, shard.search, vec, k, ids) for shard in self.shards.values())
+        )
+        hits = [(float(d), int(i)) for distances, found in results for d, i in zip(distances[0], found[0]) if i != -1]
+        return [i for _, i in sorted(hits)[:k]]
+
+    def relocate(self, path: str) -> None:
+        """Store the index at another path on the next save, writing every shard."""
+        self.path = Path(path)
+        self.shard_dir = self.path.with_suffix(".shards")
+        for name, shard in self.shards.items():
+            shard.relocate(str(self.shard_dir / f"{name}.faiss"))
+        self.dirty = set(self.shards)
+
+    async def save(self) -> None:
+        for name in sorted(self.dirty):
+            shard = self.shards[name]
+            if shard.index.ntotal:
+                await shard.save()
+            else:
+                # Shards left without vectors are dropped, so they cannot hold up an IVF rebuild of the others.
+                shard.path.unlink(missing_ok=True)
+                del self.shards[name]
+        self.dirty.clear()
+        if self.adopted_legacy:
+            self.path.unlink(missing_ok=True)
+            self.adopted_legacy = False
@@ -0,0 +1,127 @@
+import asyncio
+import shutil
+import time
+
+from pathlib import Path
+
+from luxis.core.embedding import apply_embedding_model, current_embedding_model, embed_texts, token_batches
+from luxis.core.indexing import IndexManager
+from luxis.core.schemas import EmbeddingModel
+from luxis.index.vector_index import ShardedVectorIndex, VectorIndex
+from luxis.utils.logger import logger
+
+
+class _Pacer:
+    """Spaces embedding requests to at most ``rate`` per minute, leaving provider quota for live traffic."""
+
+    def __init__(self, rate: int):
+        self.interval = 60 / rate if rate > 0 else 0.0
+        self.next_request = 0.0
+
+    async def wait(self) -> None:
+        loop = asyncio.get_running_loop()
+        delay = self.next_request - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.next_request = max(self.next_request, loop.time()) + self.interval
+
+
+async def _embed_batch(batch: list[tuple[int, str, str]], target, pacer: _Pacer) -> list[tuple[int, str, list[float]]]:
+    await pacer.wait()
+    status, embeddings = await embed_texts([text for _, _, text in batch], target)
+    if status:
+        return [(content_id, fp, emb) for (content_id, fp, _), emb in zip(batch, embeddings)]
+    results = []
+    for indices in await token_batches([text for _, _, text in batch], target):
+        await pacer.wait()
+        status, embeddings = await embed_texts([batch[i][2] for i in indices], target)
+        if not status:
+            logger.warning(f"Skipping {batch[indices[0]][1]}: text is too big to embed.")
+            continue
+        results.extend((batch[i][0], batch[i][1], emb) for i, emb in zip(indices, embeddings))
+    return results
+
+
+async def _sync_shadow(idx: IndexManager, shadow, target, embedded: dict[int, str], progress=None) -> int:
+    """Embed the contents of ``idx`` missing from ``shadow``; ``embedded`` maps the shadow's content ids to their hash.
+
+    ``progress`` is called with the number of contents done and pending after every batch.
+    """
+    contents = await idx.meta.contents()
+    # Content ids are reused once freed, so a changed hash means the id now stands for other content.
+    stale = [content_id for content_id, filehash in embedded.items() if contents.get(content_id, ("",))[0] != filehash]
+    if stale:
+        await shadow.remove(stale)
+        for content_id in stale:
+            del embedded[content_id]
+    pending = [(content_id, fh, fp) for content_id, (fh, fp) in contents.items() if content_id not in embedded]
+    pacer = _Pacer(target.ingest.migration_rate)
+    size = max(1, target.ingest.migration_batch_size)
+    if progress:
+        progress(0, len(pending))
+    for start in range(0, len(pending), size):
+        batch = []
+        for content_id, filehash, filepath in pending[start : start + size]:
+            text = await idx.content_text(filehash, filepath)
+            if text and text.strip():
+                batch.append((content_id, filepath, text))
+        if batch:
+            for content_id, filepath, embedding in await _embed_batch(batch, target, pacer):
+                await shadow.upsert(content_id, embedding, **idx.shard_kwargs(filepath))
+                embedded[content_id] = contents[content_id][0]
+        logger.info(f"Migrated {min(start + size, len(pending))}/{len(pending)} contents")
+        if progress:
+            progress(min(start + size, len(pending)), len(pending))
+    return len(pending)
+
+
+async def build_shadow(config, target, progress=None) -> tuple[VectorIndex | ShardedVectorIndex, dict[int, str]]:
+    """Embed every stored content of ``config``'s index with the ``target`` model into an in-memory shadow index.
+
+    Texts come from the text cache, so files are only extracted again if it no longer holds them.
+    The index of ``config`` is not modified and keeps serving queries.
+    """
+    start = time.time()
+    idx = IndexManager(config)
+    await idx.setup(load_vector=False, text_cache=True)
+    try:
+        shadow = type(idx.vector)(idx.vector_index_path, target.ingest.embedding_dim)
+        embedded: dict[int, str] = {}
+        await _sync_shadow(idx, shadow, target, embedded, progress)
+    finally:
+        await idx.close()
+    logger.info(f"Shadow index built with {len(embedded)} vectors. (Elapsed {time.time() - start:.2f}s)")
+    return shadow, embedded
+
+
+async def switch_to_shadow(config, target, shadow, embedded: dict[int, str], progress=None) -> int:
+    """Catch ``shadow`` up with changes made since it was built and make it ``config``'s vector index."""
+    idx = IndexManager(config)
+    await idx.setup(load_vector=False, text_cache=True)
+    try:
+        caught_up = await _sync_shadow(idx, shadow, target, embedded, progress)
+        shadow.relocate(idx.vector_index_path)
+        await shadow.save()
+        vector_path = Path(idx.vector_index_path)
+        if isinstance(shadow, ShardedVectorIndex):
+            vector_path.unlink(missing_ok=True)
+            for file in shadow.shard_dir.glob("*.faiss"):
+                if file.stem not in shadow.shards:
+                    file.unlink()
+        else:
+            shutil.rmtree(vector_path.with_suffix(".shards"), ignore_errors=True)
+        idx.record_model(current_embedding_model(target))
+    finally:
+        await idx.close()
+    logger.info(f"Switched to the shadow index ({caught_up} contents caught up).")
+    return len(embedded)
+
+
+async def run_model_migration(config, model: EmbeddingModel):
+    start = time.time()
+    target = apply_embedding_model(config.model_copy(deep=True), model)
+    logger.info(f"Migrating index to {model.model_name} (dim={model.embedding_dim})...")
+    shadow, embedded = await build_shadow(config, target)
+    count = await switch_to_shadow(config, target, shadow, embedded)
+    logger.success(f"Index migrated with {count} vectors. (Elapsed {time.time() - start:.2f}s)")
+    return count
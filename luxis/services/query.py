@@ -1,29 +1,60 @@
 from luxis.utils.logger import logger
 from luxis.core.embedding import embed_texts
 from luxis.core.indexing import IndexManager
+from luxis.core.schemas import QueryModes
+
+
+def _reciprocal_rank_fusion(rankings: list[list[int]], k: int) -> list[int]:
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+
+async def _vector_ids(text: str, idx: IndexManager, config) -> list[int]:
+    allowed_ids = await idx.meta.filter_ids(**config.query.filters())
+    if allowed_ids is not None and not allowed_ids:
+        return []
+    status, embeddings = await embed_texts([text], config)
+    if not status:
+        logger.warning("Skipping because query text is too big.")
+        return []
+    return await idx.vector.query(embeddings[0], k=config.query.top_k, ids=allowed_ids)
 
 
 async def run_query(text: str, config):
     logger.info("Running query...")
+    mode = config.query.mode
     idx = IndexManager(config)
-    await idx.setup()
+    await idx.setup(load_vector=mode != QueryModes.lexical, read_only=True)
+    try:
+        return await _run_query(text, idx, config)
+    finally:
+        await idx.close()
+
+
+async def _run_query(text: str, idx: IndexManager, config):
+    mode = config.query.mode
     if not text.strip():
         logger.warning("Query text is empty.")
         return []
-    status, embeddings = await embed_texts([text], config)
-    if not status:
-        logger.warning("Skipping because query text is too big.")
-        return []
-    emb = embeddings[0]
-    ids = await idx.vector.query(emb, k=config.query.top_k)
+    vector_ids, lexical_ids = [], []
+    if mode != QueryModes.lexical:
+        vector_ids = await _vector_ids(text, idx, config)
+    if mode != QueryModes.vector:
+        lexical_ids = await idx.meta.search_text(text, k=config.query.top_k, **config.query.filters())
+    if mode == QueryModes.hybrid:
+        ids = _reciprocal_rank_fusion([vector_ids, lexical_ids], k=config.query.rrf_k)[: config.query.top_k]
+    else:
+        ids = vector_ids or lexical_ids
     if not ids:
         logger.info("No similar documents found.")
         return []
-    logger.debug(f"Top {len(ids)} similar files:")
-    entries = []
-    for rank, id_ in enumerate(ids, start=1):
-        entry = await idx.meta.get(id_)
-        entries.append(entry.filepath)
-        logger.debug(f"{rank:>2}. {entry.filepath}  (hash={entry.filehash})" if entry else f"{rank:>2}. <missing entry id={id_}>")
+    # Identical files share one vector, so every hit expands into all paths with that content.
+    entries = (await idx.meta.paths_for(ids, **config.query.filters()))[: config.query.top_k]
+    logger.debug("Top {} similar files:", len(entries))
+    for rank, filepath in enumerate(entries, start=1):
+        logger.debug("{:>2}. {}", rank, filepath)
     logger.success("Query completed.")
     return entries
@@ -0,0 +1,266 @@
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from pathlib import Path
+
+from luxis.core.embedding import current_embedding_model
+from luxis.core.indexing import IndexManager
+from luxis.core.schemas import EmbeddingModel
+from luxis.index.snapshot_store import copy_sqlite
+from luxis.index.vector_index import DEFAULT_SHARD
+from luxis.utils.file_handler import ensure_dir_exists
+from luxis.utils.logger import logger
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+IDS = "ids.npy"
+VECTORS = "vectors.npy"
+META = "meta_index.db"
+# Names of the vector index files built during an import, before they replace the current ones.
+STAGED_INDEX = "vector_index.faiss"
+STAGED_SHARDS = "shards"
+
+
+# Vectors are exported in blocks of this many rows, so an export never holds a whole shard's vectors in memory.
+_EXPORT_CHUNK = 65536
+
+
+class _HashingWriter:
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self.file.write(data)
+
+
+def _write_npy(path: Path, dtype, shape: tuple, chunks) -> str:
+    """Write ``chunks`` of rows as one ``.npy`` file and return its sha256."""
+    with path.open("wb") as f:
+        out = _HashingWriter(f)
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+        np.lib.format.write_array_header_1_0(out, header)
+        for chunk in chunks:
+            out.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+    return out.sha256.hexdigest()
+
+
+def _index_ids(index) -> np.ndarray:
+    if hasattr(index, "id_map"):
+        return faiss.vector_to_array(index.id_map)
+    # IVF indexes keep the ids in their inverted lists.
+    invlists = faiss.extract_index_ivf(index).invlists
+    ids = []
+    for list_no in range(invlists.nlist):
+        if size := invlists.list_size(list_no):
+            ptr = invlists.get_ids(list_no)
+            ids.append(faiss.rev_swig_ptr(ptr, size).copy())
+            invlists.release_ids(list_no, ptr)
+    return np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+
+
+def _vector_chunks(index, ids: np.ndarray):
+    """Yield the vectors of ``ids``, in that order, in blocks of ``_EXPORT_CHUNK`` rows."""
+    if hasattr(index, "id_map"):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexIVF):
+            inner.make_direct_map()
+        for start in range(0, inner.ntotal, _EXPORT_CHUNK):
+            yield inner.reconstruct_n(start, min(_EXPORT_CHUNK, inner.ntotal - start))
+        return
+    # Ids of IVF indexes are not sequential, so they are looked up through a hash table.
+    faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Hashtable)
+    for start in range(0, len(ids), _EXPORT_CHUNK):
+        yield index.reconstruct_batch(ids[start : start + _EXPORT_CHUNK])
+
+
+def _write_archive(archive: Path, shards: list, meta_path: Path, manifest: dict) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        ids = [_index_ids(shard.index) for _, shard in shards]
+        total, dim = sum(len(shard_ids) for shard_ids in ids), manifest["embedding_dim"]
+        # Checksums are taken while the members are written, as the manifest holding them has to come first.
+        chunks = (chunk for (_, shard), shard_ids in zip(shards, ids) for chunk in _vector_chunks(shard.index, shard_ids))
+        checksums = {
+            IDS: _write_npy(tmp / IDS, np.int64, (total,), ids),
+            VECTORS: _write_npy(tmp / VECTORS, np.float32, (total, dim), chunks),
+        }
+        copy_sqlite(meta_path, tmp / META)
+        with (tmp / META).open("rb") as f:
+            checksums[META] = hashlib.file_digest(f, "sha256").hexdigest()
+        manifest["checksums"] = checksums
+        data = json.dumps(manifest).encode()
+        with tarfile.open(archive, "w:gz") as tar:
+            # The manifest comes first so imports can verify members while streaming.
+            info = tarfile.TarInfo(MANIFEST)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            for name in (IDS, VECTORS, META):
+                tar.add(tmp / name, arcname=name)
+
+
+def _default_nprobe(nlist: int) -> int:
+    return max(1, round(math.sqrt(nlist)))
+
+
+def _build_index(dim: int, index_type: str | None, vectors: np.ndarray, nprobe: int | None, shard: str | None):
+    if not index_type:
+        return faiss.IndexIDMap(faiss.IndexFlatL2(dim))
+    index = faiss.index_factory(dim, index_type)
+    ivf = faiss.try_extract_index_ivf(index)
+    if not index.is_trained:
+        minimum = ivf.nlist if ivf is not None else 1
+        if len(vectors) < minimum:
+            raise ValueError(
+                f"Shard {shard or DEFAULT_SHARD} has {len(vectors)} vectors, {index_type} needs at least {minimum} to train."
+            )
+        try:
+            index.train(vectors)
+        except RuntimeError as e:
+            raise ValueError(f"Cannot train {index_type} on shard {shard or DEFAULT_SHARD}: {e}") from e
+    if ivf is not None:
+        ivf.nprobe = nprobe or _default_nprobe(ivf.nlist)
+        # IVF stores the ids itself; an IndexIDMap around it loses track of them once vectors are removed.
+        return index
+    return index if hasattr(index, "id_map") else faiss.IndexIDMap(index)
+
+
+async def export_snapshot(config, archive: Path) -> dict:
+    """Write the vectors, ids and metadata of the configured index into one checksummed tar.gz archive."""
+    start = time.time()
+    idx = IndexManager(config)
+    await idx.setup(read_only=True)
+    try:
+        shards = sorted(idx.vector.shards.items()) if idx.sharded else [(None, idx.vector)]
+        # Empty shards carry nothing to restore and could not be trained into an IVF index.
+        shards = [(name, shard) for name, shard in shards if shard.index.ntotal]
+        manifest = {
+            "format": FORMAT_VERSION,
+            "created": time.time(),
+            "embedding_dim": config.ingest.embedding_dim,
+            "model": current_embedding_model(config).model_dump(),
+            "shards": [{"name": name, "count": shard.index.ntotal} for name, shard in shards],
+        }
+        await asyncio.to_thread(_write_archive, archive, shards, Path(config.settings.meta_index_path), manifest)
+    finally:
+        await idx.close()
+    count = sum(shard["count"] for shard in manifest["shards"])
+    logger.info(f"Exported {count} vectors to {archive} (Elapsed {time.time() - start:.2f}s)")
+    return manifest
+
+
+def _unpack(archive: Path, tmp: Path) -> dict:
+    """Extract ``archive`` into ``tmp``, verifying every member against the manifest, and return the manifest."""
+    with tarfile.open(archive, "r|gz") as tar:
+        first = tar.next()
+        if first is None or first.name != MANIFEST:
+            raise ValueError("Snapshot archive does not start with a manifest.")
+        manifest = json.load(tar.extractfile(first))
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+        expected = dict(manifest["checksums"])
+        while (member := tar.next()) is not None:
+            if member.name not in expected:
+                raise ValueError(f"Unexpected snapshot member: {member.name}")
+            h = hashlib.sha256()
+            with tar.extractfile(member) as src, (tmp / member.name).open("wb") as dst:
+                for chunk in iter(lambda: src.read(1 << 20), b""):
+                    h.update(chunk)
+                    dst.write(chunk)
+            if h.hexdigest() != expected.pop(member.name):
+                raise ValueError(f"Checksum mismatch for snapshot member: {member.name}")
+        if expected:
+            raise ValueError(f"Snapshot archive is missing members: {sorted(expected)}")
+    return manifest
+
+
+def _recorded_model(config, manifest: dict, model_name: str | None) -> EmbeddingModel | None:
+    dim = manifest["embedding_dim"]
+    model = EmbeddingModel.model_validate(manifest["model"]) if manifest.get("model") else None
+    if model_name and (model is None or model.model_name != model_name):
+        recorded = model.model_name if model else "an unrecorded model"
+        raise ValueError(f"Snapshot was embedded with {recorded}, not {model_name}.")
+    # Archives from before models were recorded are assumed to match the configured model.
+    expected_dim = model.embedding_dim if model else config.ingest.embedding_dim
+    if dim != expected_dim:
+        raise ValueError(f"Snapshot embedding_dim {dim} does not match {expected_dim}.")
+    return model
+
+
+def _build_shards(tmp: Path, manifest: dict, index_type: str | None, nprobe: int | None) -> None:
+    """Build the index of every shard into ``tmp``, as ``STAGED_INDEX`` or ``STAGED_SHARDS/<shard>.faiss``."""
+    dim = manifest["embedding_dim"]
+    ids = np.load(tmp / IDS, mmap_mode="r", allow_pickle=False)
+    vectors = np.load(tmp / VECTORS, mmap_mode="r", allow_pickle=False)
+    offset = 0
+    for shard in manifest["shards"]:
+        chunk = slice(offset, offset + shard["count"])
+        offset += shard["count"]
+        if not shard["count"]:
+            # Archives from before empty shards were dropped on save may still list them.
+            continue
+        index = _build_index(dim, index_type, vectors[chunk], nprobe, shard["name"])
+        index.add_with_ids(vectors[chunk], ids[chunk])
+        path = tmp / STAGED_SHARDS / f"{shard['name']}.faiss" if shard["name"] else tmp / STAGED_INDEX
+        path.parent.mkdir(exist_ok=True)
+        faiss.write_index(index, str(path))
+
+
+def _prepare_import(config, archive: Path, tmp: Path, index_type, model_name, nprobe) -> tuple[dict, EmbeddingModel | None]:
+    manifest = _unpack(archive, tmp)
+    model = _recorded_model(config, manifest, model_name)
+    _build_shards(tmp, manifest, index_type, nprobe)
+    return manifest, model
+
+
+async def import_snapshot(
+    config, archive: Path, index_type: str | None = None, model_name: str | None = None, nprobe: int | None = None
+) -> dict:
+    """Replace the configured index with the contents of an exported archive.
+
+    ``index_type`` is a FAISS factory string (e.g. ``IVF256,Flat``) to rebuild the stored vectors into; the
+    default is the flat index that ingest builds. Index types used for further ingests must support removal.
+    IVF indexes search ``nprobe`` lists per query, by default the square root of their list count. Every shard is
+    built before the existing index is replaced, so a shard too small to train leaves it untouched.
+    The embedding model recorded in the archive is restored with the index; ``model_name`` refuses archives
+    embedded with any other model.
+    """
+    start = time.time()
+    vector_path = Path(config.settings.vector_index_path)
+    meta_path = Path(config.settings.meta_index_path)
+    await ensure_dir_exists(vector_path.parent)
+    await ensure_dir_exists(meta_path.parent)
+    # Staged next to the index, so the built files are moved into place rather than copied.
+    with tempfile.TemporaryDirectory(dir=vector_path.parent, prefix=".import-") as tmp:
+        tmp = Path(tmp)
+        # Unpacking, verifying and training take minutes on large archives; other tenants keep being served meanwhile.
+        manifest, model = await asyncio.to_thread(_prepare_import, config, archive, tmp, index_type, model_name, nprobe)
+        shard_dir = vector_path.with_suffix(".shards")
+        model_path = vector_path.with_suffix(".model.json")
+        vector_path.unlink(missing_ok=True)
+        model_path.unlink(missing_ok=True)
+        await asyncio.to_thread(shutil.rmtree, shard_dir, ignore_errors=True)
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{meta_path}{suffix}").unlink(missing_ok=True)
+        await asyncio.to_thread(shutil.move, tmp / META, meta_path)
+        if (tmp / STAGED_INDEX).exists():
+            os.replace(tmp / STAGED_INDEX, vector_path)
+        if (tmp / STAGED_SHARDS).exists():
+            os.replace(tmp / STAGED_SHARDS, shard_dir)
+        if model is not None:
+            model_path.write_text(model.model_dump_json())
+    count = sum(shard["count"] for shard in manifest["shards"])
+    logger.info(f"Imported {count} vectors from {archive} (Elapsed {time.time() - start:.2f}s)")
+    return manifest
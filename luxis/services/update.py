@@ -1,33 +1,49 @@
 import time
 
 from luxis.utils.logger import logger
-from luxis.core.hashing import sha256sum
-from luxis.core.embedding import extract_text, embed_texts
+from luxis.core.hashing import read_file
+from luxis.core.embedding import extract_text, embed_texts, token_batches
 from luxis.core.scanner import scan_directories
 from luxis.core.indexing import IndexManager
 
 
 async def _collect_candidates(config, idx):
-    candidates, all_files = [], []
+    candidates, links, all_files = [], [], []
+    known_hashes = await idx.meta.filehashes()
+    # Content that already has (or is about to get) a vector is linked instead of embedded again.
+    stored_contents = await idx.meta.content_hashes()
     for directory_cfg in config.directories:
         base, include, ignore = directory_cfg.path, directory_cfg.include, directory_cfg.ignore
         files = await scan_directories(base, include, ignore)
         logger.info(f"Scanning {base}, found {len(files)} files")
-        all_files.append(files)
+        excluded = set()
         for file_path in files:
             try:
-                filehash = await sha256sum(file_path)
-                existing = await idx.meta.get_by_filepath(str(file_path))
-                if existing and existing.filehash == filehash:
-                    logger.debug(f"Skipping unchanged: {file_path}")
-                    continue
-                text = await extract_text(file_path)
+                async with read_file(file_path, directory_cfg.policy_for(file_path)) as content:
+                    if content is None:
+                        excluded.add(file_path)
+                        continue
+                    filehash, data = content
+                    if known_hashes.get(str(file_path)) == filehash:
+                        logger.debug("Skipping unchanged: {}", file_path)
+                        continue
+                    if filehash in stored_contents:
+                        logger.debug("Linking duplicate content: {}", file_path)
+                        links.append((str(file_path), filehash))
+                        continue
+                    text = await idx.text_cache.get(filehash)
+                    if text is None:
+                        text = await extract_text(file_path, data)
+                        await idx.text_cache.put(filehash, text)
                 if text.strip():
                     logger.info(f"Adding {file_path} with {len(text)} characters.")
                     candidates.append((text, str(file_path), filehash))
+                    stored_contents.add(filehash)
             except Exception as e:
                 logger.warning(f"Skipping {file_path}: {e}")
-    return candidates, all_files
+        # Files excluded by a policy are pruned from the index like ignored files.
+        all_files.append([f for f in files if f not in excluded])
+    return candidates, links, all_files
 
 
 async def _process_embeddings(candidates, config):
@@ -36,35 +52,45 @@ async def _process_embeddings(candidates, config):
     status, embeddings = await embed_texts(texts, config)
     if status:
         logger.info("Batch embedding succeeded.")
-        return [(emb, fp, fh) for (t, fp, fh), emb in zip(candidates, embeddings)]
-    logger.info("Falling back to single embeddings.")
+        return [(emb, fp, fh, t) for (t, fp, fh), emb in zip(candidates, embeddings)]
+    logger.info("Falling back to smaller batches.")
     entries = []
-    for text, fp, fh in candidates:
-        logger.info(f"Processing {fp}...")
-        st, emb = await embed_texts([text], config)
-        if st:
-            entries.append((emb[0], fp, fh))
+    # Token counts are cached from the attempt above, so packing the batches does not tokenise again.
+    for batch in await token_batches(texts, config):
+        logger.info(f"Processing {len(batch)} files...")
+        st, emb = await embed_texts([texts[i] for i in batch], config)
+        if not st:
+            logger.warning(f"Skipping {candidates[batch[0]][1]}: text is too big to embed.")
+            continue
+        for i, e in zip(batch, emb):
+            text, fp, fh = candidates[i]
+            entries.append((e, fp, fh, text))
     return entries
 
 
 async def run_index_update(config, clean_index: bool):
     start = time.time()
     idx = IndexManager(config)
-    await idx.setup(clean_index)
-    logger.info("Updating index...")
-    candidates, all_files = await _collect_candidates(config, idx)
-    if not candidates:
-        logger.info("No valid files to index.")
-    else:
-        entries = await _process_embeddings(candidates, config)
-        if entries:
-            await idx.update(entries)
-            logger.success(f"Index updated with {len(entries)} files.")
-    combined_files = [str(p) for sublist in all_files for p in sublist]
-    response = {
-        "removed_files": await idx.prune_missing(combined_files),
-        "indexed_files": [files for files in all_files],
-        "updated_files": [fp for t, fp, fh in candidates],
-    }
+    await idx.setup(clean_index, text_cache=True)
+    try:
+        logger.info("Updating index...")
+        candidates, links, all_files = await _collect_candidates(config, idx)
+        linked = []
+        if not candidates and not links:
+            logger.info("No valid files to index.")
+        else:
+            entries = await _process_embeddings(candidates, config) if candidates else []
+            if entries or links:
+                linked = await idx.update(entries, links)
+                logger.success(f"Index updated with {len(entries) + len(linked)} files.")
+        combined_files = [str(p) for sublist in all_files for p in sublist]
+        response = {
+            "removed_files": await idx.prune_missing(combined_files),
+            "indexed_files": [files for files in all_files],
+            "updated_files": [fp for t, fp, fh in candidates] + linked,
+        }
+        await idx.backfill_texts()
+    finally:
+        await idx.close()
     logger.info(f"Index update complete. (Elapsed {time.time() - start:.2f}s)")
     return response
@@ -1,14 +1,30 @@
+import asyncio
 import json
 import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
 import uuid
 
 import luxis.daemon as daemon
 
 from pathlib import Path
+from starlette.requests import Request
+from starlette.responses import Response
 
+from luxis.core.embedding import embedding_model_name
 from luxis.core.schemas import Config, AIProviders
+from luxis.index.snapshot_store import SnapshotStore, VECTOR_INDEX_FILE, META_INDEX_FILE
+from luxis.services import migrate
 from luxis.utils.logger import logger
 
+_snapshot_stores: dict[uuid.UUID, SnapshotStore] = {}
+# Model migrations run in the background of the writer process, one per user; the tasks are kept so they are not
+# garbage collected while running.
+_migrations: dict[uuid.UUID, dict] = {}
+_migration_tasks: dict[uuid.UUID, asyncio.Task] = {}
+
 
 async def _user_config_path(user_id: uuid.UUID) -> Path:
     return daemon.CONFIG_DIR / f"{user_id}.json"
@@ -18,13 +34,25 @@ async def _remove_user_config(user_id):
     os.remove(await _user_config_path(user_id))
 
 
+def _write_user_config(path: Path, cfg: Config) -> None:
+    # Other processes read the file concurrently, so replace it whole; the process id keeps writers apart.
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(cfg.model_dump_json(indent=2))
+    os.replace(tmp, path)
+
+
+async def _save_user_config(user_id: uuid.UUID, cfg: Config) -> None:
+    _write_user_config(await _user_config_path(user_id), cfg)
+
+
 def _build_user_paths(base_config: Config, user_id: uuid.UUID) -> Config:
     cfg = base_config.model_copy(deep=True)
     base_dir = Path(base_config.daemon.base_data_dir)
     user_dir = base_dir / str(user_id)
     user_dir.mkdir(parents=True, exist_ok=True)
-    cfg.settings.vector_index_path = str(user_dir / "vector_index.faiss")
-    cfg.settings.meta_index_path = str(user_dir / "meta_index.db")
+    cfg.settings.vector_index_path = str(user_dir / VECTOR_INDEX_FILE)
+    cfg.settings.meta_index_path = str(user_dir / META_INDEX_FILE)
+    cfg.settings.text_cache_path = str(base_dir / "text_cache" / str(user_id))
     return cfg
 
 
@@ -41,7 +69,7 @@ async def _load_or_create_user_config(base_config: Config, user_id: uuid.UUID, i
     else:
         logger.info(f"Found no user config for user {user_id}, will create a new one.")
     cfg = _build_user_paths(base_config, user_id)
-    path.write_text(cfg.model_dump_json(indent=2))
+    _write_user_config(path, cfg)
     return cfg
 
 
@@ -56,3 +84,103 @@ async def _replace_api_key_in_config(cfg, api_key_info):
     else:
         logger.error(f"Unknown AIProvider: {ai_provider}")
     return cfg
+
+
+def _user_snapshots(user_id: uuid.UUID) -> SnapshotStore:
+    store = _snapshot_stores.get(user_id)
+    if store is None:
+        user_dir = Path(daemon.BASE_CONFIG.daemon.base_data_dir) / str(user_id)
+        if daemon.BASE_CONFIG.daemon.workers <= 1:
+            store = SnapshotStore(user_dir)
+        else:
+            # Readers in other processes are invisible here, so the writer keeps the previous snapshot around
+            # and query workers never delete anything.
+            store = SnapshotStore(user_dir, retain=1, collect=daemon.WRITER_URL is None)
+        _snapshot_stores[user_id] = store
+    return store
+
+
+async def _run_migration(user_id: uuid.UUID, cfg: Config, target: Config, status: dict) -> None:
+    def progress(done: int, pending: int) -> None:
+        status.update(done=done, pending=pending)
+
+    # Queries keep using the published snapshot while the shadow index is built; ingests are only held back while
+    # the shadow catches up with them and is published as the next snapshot.
+    store = _user_snapshots(user_id)
+    try:
+        async with store.read() as pinned:
+            pinned_cfg = _pin_index_paths(cfg.model_copy(deep=True), pinned)
+            shadow, embedded = await migrate.build_shadow(pinned_cfg, target, progress)
+        status["state"] = "switching"
+        async with store.write() as staging:
+            count = await migrate.switch_to_shadow(_pin_index_paths(cfg, staging), target, shadow, embedded, progress)
+            await _save_user_config(user_id, target)
+        status.update(state="success", vectors=count)
+    except Exception as e:
+        logger.exception(f"Model migration of user {user_id} failed")
+        status.update(state="failed", error=str(e))
+    finally:
+        status["finished"] = time.time()
+        _migration_tasks.pop(user_id, None)
+
+
+def _start_migration(user_id: uuid.UUID, cfg: Config, target: Config) -> dict | None:
+    """Start migrating the user's index to the model of ``target``; returns ``None`` if one is already running."""
+    if user_id in _migration_tasks:
+        return None
+    status = {
+        "state": "building",
+        "model_name": embedding_model_name(target),
+        "embedding_dim": target.ingest.embedding_dim,
+        "started": time.time(),
+        "done": 0,
+        "pending": None,
+    }
+    _migrations[user_id] = status
+    _migration_tasks[user_id] = asyncio.create_task(_run_migration(user_id, cfg, target, status))
+    return status
+
+
+def _migration_status(user_id: uuid.UUID) -> dict | None:
+    return _migrations.get(user_id)
+
+
+def _pin_index_paths(cfg: Config, directory: Path) -> Config:
+    cfg.settings.vector_index_path = str(directory / VECTOR_INDEX_FILE)
+    cfg.settings.meta_index_path = str(directory / META_INDEX_FILE)
+    return cfg
+
+
+async def _forward_to_writer(request: Request) -> Response:
+    # Bodies such as snapshot archives can be large, so they are spooled to disk rather than held in memory.
+    body = tempfile.TemporaryFile()
+    try:
+        async for chunk in request.stream():
+            body.write(chunk)
+        size = body.tell()
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    forwarded = urllib.request.Request(
+        f"{daemon.WRITER_URL}{request.url.path}?{request.url.query}",
+        data=body,
+        method=request.method,
+        headers={
+            "api-key": request.headers.get("api-key", ""),
+            "content-type": request.headers.get("content-type", "application/json"),
+            "content-length": str(size),
+        },
+    )
+
+    def send():
+        try:
+            with urllib.request.urlopen(forwarded) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        finally:
+            body.close()
+
+    status, body = await asyncio.to_thread(send)
+    return Response(content=body, status_code=status, media_type="application/json")
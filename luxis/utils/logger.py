@@ -1,3 +1,4 @@
+import functools
 import logging
 import re
 import sys
@@ -15,178 +16,158 @@ level_icons = {
     "CRITICAL": "💥",
 }
 
-tags = ["red", "blue", "green", "magenta", "yellow", "blink", "bold", "white", "cyan", "black", "bold", "blink", "level", "le"]
-
-
-def color_http(text):
-    HTTP_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "HEAD"]
-
-    def code_color(code):
-        if 200 <= code < 300:
-            return "green"
-        elif 300 <= code < 400:
-            return "yellow"
-        elif 400 <= code < 600:
-            return "red"
-        else:
-            return "white"
-
-    for method in HTTP_METHODS:
-        pattern = rf"\b{method}\b"
-        replacement = f"<blue>{method}</blue>"
-        text = re.sub(pattern, replacement, text)
-
-    text = re.sub(
-        r"\bhttps?\b",
-        lambda m: f"<magenta>{m.group(0)}</magenta>",
-        text,
-        flags=re.IGNORECASE,
-    )
-
-    for status in HTTPStatus:
-        code = str(status.value)
-        color = code_color(status.value)
-        pattern = rf"\b{code}\b"
-        replacement = f"<{color}>{code}</{color}>"
-        text = re.sub(pattern, replacement, text)
-
-    return text
-
-
-def colorize_outside_tags(text):
-    result = []
-    i = 0
-
-    while i < len(text):
-        if text[i] == "<":
-            # Find the end of this potential tag
-            tag_end = text.find(">", i)
-            if tag_end != -1:
-                potential_tag = text[i : tag_end + 1]
-                # Check if it's a valid Loguru tag (including closing tags)
-                if re.match(r"</?(?:red|green|blue|yellow|magenta|cyan|white|black|bold|blink|level|reset)>", potential_tag):
-                    result.append(potential_tag)
-                    i = tag_end + 1
-                    continue
-
-        # Colorize individual characters
-        c = text[i]
-        if c == ":":
-            result.append("<red>:</red>")
-        elif c == "/":
-            result.append("<yellow>/</yellow>")
-        elif c == ".":
-            result.append("<green>.</green>")
-        elif c == "{":
-            result.append("<red>{</red>")
-        elif c == "}":
-            result.append("<red>}</red>")
-        elif c == "[":
-            result.append("<cyan>[</cyan>")
-        elif c == "]":
-            result.append("<cyan>]</cyan>")
-        elif c == "'":
-            result.append("<green>'</green>")
-        elif c == '"':
-            result.append('<green>"</green>')
-        elif c == "_":
-            result.append("<magenta>_</magenta>")
-        elif c == "@":
-            result.append("<magenta>@</magenta>")
-        elif c == "*":
-            result.append("<magenta>*</magenta>")
-        elif c == "-":
-            result.append("<magenta>-</magenta>")
-        elif c == ",":
-            result.append("<green>,</green>")
-        else:
-            result.append(c)
-        i += 1
-
-    return "".join(result)
-
-
-def validate_balanced_tags(text):
-    tags = {"red", "blue", "green", "magenta", "yellow", "blink", "bold", "white", "cyan", "black", "level"}
-    tag_pattern = re.compile(r"<(/?)(\w+)>")
-    stack = []
-    for match in tag_pattern.finditer(text):
-        is_close = match.group(1) == "/"
-        name = match.group(2)
-        if name not in tags:
-            start, end = match.span()
-            text = text[:start] + text[start:end].replace("<", "\\<") + text[end:]
-            continue
-        if not is_close:
-            stack.append(name)
-        else:
-            if not stack or stack[-1] != name:
-                return tag_pattern.sub(lambda m: "" if m.group(2) in tags else m.group(0), text)
-            stack.pop()
-    if stack:
-        return tag_pattern.sub(lambda m: "" if m.group(2) in tags else m.group(0), text)
-    return text
-
+tags = ["red", "green", "blue", "yellow", "magenta", "cyan", "white", "black", "bold", "blink", "level", "reset"]
 
-def escape(text):
-    message_str = text.replace("{", "{{").replace("}", "}}")
-    pattern = re.compile(r"(<[^>]+>|[A-Za-z0-9_]+>)")
+HTTP_METHODS = ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH", "HEAD"]
 
-    def escape_match(m):
-        s = m.group(0)
-        for tag in tags:
-            if f"<{tag}>" == s:
-                return s
-            if f"</{tag}>" == s:
-                return s
-        return s.replace("<", "\\<")
+PLAIN_FORMAT = "{time:YY-MM-DD HH:mm:ss}|{level: <8}|{name}:{line} | {message}"
 
-    text = pattern.sub(escape_match, message_str)
-    return text
 
+def _code_color(code):
+    if 200 <= code < 300:
+        return "green"
+    elif 300 <= code < 400:
+        return "yellow"
+    elif 400 <= code < 600:
+        return "red"
+    else:
+        return "white"
+
+
+def _markup(color, text):
+    # Braces are doubled because the formatter output is used as a loguru format string.
+    text = text.replace("{", "{{").replace("}", "}}")
+    return f"<{color}>{text}</{color}>"
+
+
+_PUNCT_MARKUP = {
+    c: _markup(color, c)
+    for c, color in {
+        ":": "red",
+        "/": "yellow",
+        ".": "green",
+        "{": "red",
+        "}": "red",
+        "[": "cyan",
+        "]": "cyan",
+        "'": "green",
+        '"': "green",
+        "_": "magenta",
+        "@": "magenta",
+        "*": "magenta",
+        "-": "magenta",
+        ",": "green",
+    }.items()
+}
+_STATUS_MARKUP = {str(s.value): _markup(_code_color(s.value), str(s.value)) for s in HTTPStatus}
+_METHOD_MARKUP = {m: _markup("blue", m) for m in HTTP_METHODS}
+
+# One combined pattern so every message is scanned exactly once.
+_TOKEN_PATTERN = re.compile(
+    rf"(?P<tag></?(?:{'|'.join(tags)})>)"
+    rf"|\b(?P<method>{'|'.join(HTTP_METHODS)})\b"
+    r"|\b(?P<scheme>(?i:https?))\b"
+    rf"|\b(?P<status>{'|'.join(_STATUS_MARKUP)})\b"
+    r"|(?P<punct>[:/.{}\[\]'\"_@*\-,])"
+    r"|(?P<lt><)"
+    r"|(?P<backslash>\\+)"
+)
+
+
+def colorize(text, keep_tags=True):
+    """Colorize a message and escape it for use in a loguru format string.
+
+    Returns the markup and the color tags that were already present in ``text``.
+    """
+    raw_tags = []
+
+    def replace(m):
+        kind = m.lastgroup
+        s = m.group(0)
+        if kind == "punct":
+            return _PUNCT_MARKUP[s]
+        if kind == "status":
+            return _STATUS_MARKUP[s]
+        if kind == "method":
+            return _METHOD_MARKUP[s]
+        if kind == "scheme":
+            return _markup("magenta", s)
+        if kind == "tag" and keep_tags:
+            raw_tags.append(s)
+            return s
+        if kind == "backslash":
+            # Loguru only unescapes backslashes right before a tag, which every replacement here starts with.
+            return s * 2 if _TOKEN_PATTERN.match(text, m.end()) else s
+        return "\\" + s
+
+    return _TOKEN_PATTERN.sub(replace, text), raw_tags
+
+
+def tags_balanced(raw_tags):
+    stack = []
+    for tag in raw_tags:
+        name = tag.strip("</>")
+        if not tag.startswith("</"):
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
 
-def formatter(record):
-    time_str = f"<green>{record['time']:%y-%m-%d %H:%M:%S}</green>"
-    icon = level_icons.get(record["level"].name, "")
-    if record["level"].name in ["WARNING", "ERROR", "CRITICAL"]:
-        icon = f"<blink>{icon}</blink>"
 
-    file_path = record["file"].path
+@functools.lru_cache(maxsize=1024)
+def _location(file_path, line):
     parts = file_path.split("migros-rag-service")
     file_path = "." + parts[-1]
     max_len = 40
-    loc_content = f"{file_path}:{record['line']}"
+    loc_content = f"{file_path}:{line}"
     if len(loc_content) > max_len:
         loc_content = "..." + loc_content[-(max_len - 3) :]
     else:
         loc_content = loc_content.ljust(max_len)
+    loc_content = loc_content.replace("<", "\\<")
     for base_dir in ["src", "eval", "tests"]:
         if base_dir in file_path:
             loc_content = f"<bold>{loc_content}</bold>"
             break
-    loc_str = f"<white>{loc_content}</white>"
+    return f"<white>{loc_content}</white>"
+
+
+def formatter(record):
+    time_str = f"<green>{record['time']:%y-%m-%d %H:%M:%S}</green>"
+    icon = level_icons.get(record["level"].name, "")
+    if record["level"].name in ["WARNING", "ERROR", "CRITICAL"]:
+        icon = f"<blink>{icon}</blink>"
 
-    message_str = str(record["message"])
-    # message_str = message_str[:1024]
+    loc_str = _location(record["file"].path, record["line"])
 
-    message_str = colorize_outside_tags(message_str)
-    message_str = color_http(message_str)
-    message_str = escape(message_str)
-    message_str = validate_balanced_tags(message_str)
+    message_str, raw_tags = colorize(str(record["message"]))
+    if raw_tags and not tags_balanced(raw_tags):
+        message_str, _ = colorize(str(record["message"]), keep_tags=False)
 
     return "|".join([time_str, icon, loc_str + " ", " " + message_str]) + "\n"
 
 
-def setup_logging(log_level="INFO", settings=None):
+def setup_logging(log_level="INFO", settings=None, log_format="auto"):
+    """Configure the stderr sink.
+
+    ``log_format`` is one of ``auto``, ``color``, ``plain`` or ``json``; ``auto`` colorizes only
+    when stderr is a terminal. Records are enqueued so callers never block on the write.
+    """
     if settings and hasattr(settings, "log_level"):
         log_level = settings.log_level
+    if settings and hasattr(settings, "log_format"):
+        log_format = settings.log_format
+    log_format = str(getattr(log_format, "value", log_format))
+    if log_format == "auto":
+        log_format = "color" if sys.stderr.isatty() else "plain"
+
     logger.remove()
-    logger.add(
-        sys.stderr,
-        colorize=True,
-        format=formatter,
-        level=log_level,
-    )
+    if log_format == "color":
+        logger.add(sys.stderr, colorize=True, format=formatter, level=log_level, enqueue=True)
+    elif log_format == "json":
+        logger.add(sys.stderr, colorize=False, format="{message}", serialize=True, level=log_level, enqueue=True)
+    else:
+        logger.add(sys.stderr, colorize=False, format=PLAIN_FORMAT, level=log_level, enqueue=True)
     logging.basicConfig(handlers=[], level=0, force=True)
 
     class InterceptHandler(logging.Handler):
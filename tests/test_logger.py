@@ -0,0 +1,28 @@
+import io
+
+import pytest
+
+from loguru import logger
+from luxis.utils.logger import formatter
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        "GET http://localhost:8765/query 200",
+        "a <b> c {d} [e]",
+        r"C:\Users\<name>",
+        r"C:\Users\me\.cache\luxis",
+        r"\\server\share\<dir>\file.txt",
+        r"escaped \\<red> tag",
+        "trailing backslash \\",
+    ],
+)
+def test_color_format_renders_message_verbatim(message):
+    out = io.StringIO()
+    sink = logger.add(out, colorize=False, format=formatter)
+    try:
+        logger.info(message)
+    finally:
+        logger.remove(sink)
+    assert out.getvalue().endswith(f"| {message}\n")
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from luxis.core.schemas import Config
+from luxis.index.meta_index import MetaIndex
+from luxis.index.vector_index import ShardedVectorIndex, VectorIndex
+from luxis.services.snapshot import export_snapshot, import_snapshot
+
+DIM = 8
+
+
+def _config(directory) -> Config:
+    config = Config(openai_settings={"openai_api_key": "key", "openai_model_name": "model"})
+    config.ingest.embedding_dim = DIM
+    config.settings.vector_index_path = str(directory / "vector_index.faiss")
+    config.settings.meta_index_path = str(directory / "meta_index.db")
+    return config
+
+
+async def _index(config) -> VectorIndex:
+    index = VectorIndex(config.settings.vector_index_path, DIM)
+    await index.setup()
+    return index
+
+
+@pytest.mark.asyncio
+async def test_ivf_import_survives_removal_and_reexport(tmp_path):
+    vectors = {1000 + i: v for i, v in enumerate(np.random.default_rng(0).random((400, DIM), dtype=np.float32))}
+    source = _config(tmp_path / "source")
+    index = VectorIndex(source.settings.vector_index_path, DIM)
+    for id_, vector in vectors.items():
+        await index.upsert(id_, vector.tolist())
+    await index.save()
+    await (await MetaIndex.open(source.settings.meta_index_path)).close()
+    await export_snapshot(source, tmp_path / "source.tar.gz")
+
+    imported = _config(tmp_path / "imported")
+    await import_snapshot(imported, tmp_path / "source.tar.gz", index_type="IVF4,Flat", nprobe=4)
+    index = await _index(imported)
+    assert await index.remove([1001, 1002, 1003]) == 3
+    for id_ in (1000, 1004, 1300):
+        assert (await index.query(vectors[id_].tolist(), k=1)) == [id_]
+    assert (await index.query(vectors[1300].tolist(), k=1, ids=[1100, 1300])) == [1300]
+    await index.save()
+
+    await export_snapshot(imported, tmp_path / "imported.tar.gz")
+    reimported = _config(tmp_path / "reimported")
+    manifest = await import_snapshot(reimported, tmp_path / "imported.tar.gz")
+    assert manifest["shards"][0]["count"] == len(vectors) - 3
+    index = await _index(reimported)
+    for id_ in (1000, 1004, 1300):
+        distances, found = index.search(vectors[id_][None], 1)
+        assert (found[0][0], distances[0][0]) == (id_, 0)
+    assert (await index.query(vectors[1002].tolist(), k=1)) != [1002]
+
+
+@pytest.mark.asyncio
+async def test_empty_shards_do_not_block_ivf_import(tmp_path):
+    vectors = np.random.default_rng(1).random((8, DIM), dtype=np.float32)
+    source = _config(tmp_path / "source")
+    index = ShardedVectorIndex(source.settings.vector_index_path, DIM)
+    for id_, vector in enumerate(vectors):
+        await index.upsert(id_, vector.tolist(), shard="kept")
+    await index.upsert(100, vectors[0].tolist(), shard="emptied")
+    await index.save()
+    await index.remove([100])
+    await index.save()
+    await (await MetaIndex.open(source.settings.meta_index_path)).close()
+    manifest = await export_snapshot(source, tmp_path / "source.tar.gz")
+    assert [shard["name"] for shard in manifest["shards"]] == ["kept"]
+
+    imported = _config(tmp_path / "imported")
+    await import_snapshot(imported, tmp_path / "source.tar.gz", index_type="IVF2,Flat", nprobe=2)
+    index = ShardedVectorIndex(imported.settings.vector_index_path, DIM)
+    await index.setup()
+    assert list(index.shards) == ["kept"]
+    assert (await index.query(vectors[3].tolist(), k=1)) == [3]